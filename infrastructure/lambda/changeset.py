@@ -0,0 +1,65 @@
+"""
+Row-level change log for the SQLite DB (stand-in for the SQLite session extension,
+which Python's sqlite3 module does not expose).
+
+fetch_and_update records every row it upserts; the handler ships the result to S3
+as a small gzip JSON delta. Consumers apply deltas in sequence order on top of the
+snapshot they belong to (web/scripts/fetch-data.mjs does the same in JS).
+
+Delta format:
+  {"version": 1, "seq": n, "snapshot_etag": "...", "created_at": "...",
+   "tables": [{"table": "videos", "key": ["id"], "columns": [...], "rows": [[...], ...]}]}
+
+Tables are listed in write order so foreign keys hold when applied in order.
+"""
+
+import gzip
+import json
+from datetime import datetime, timezone
+
+from db import upsert_rows
+
+FORMAT_VERSION = 1
+
+
+class Changeset:
+    def __init__(self):
+        self.tables = []
+
+    def __bool__(self):
+        return any(t['rows'] for t in self.tables)
+
+    def record(self, table, key, columns, rows):
+        """Record upserted rows (tuples in `columns` order) for `table`."""
+        rows = [list(r) for r in rows]
+        if rows:
+            self.tables.append({'table': table, 'key': list(key), 'columns': list(columns), 'rows': rows})
+
+    def encode(self, seq, snapshot_etag):
+        body = {
+            'version': FORMAT_VERSION,
+            'seq': seq,
+            'snapshot_etag': snapshot_etag,
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'tables': self.tables,
+        }
+        return gzip.compress(json.dumps(body, ensure_ascii=False).encode())
+
+
+def decode(data):
+    body = json.loads(gzip.decompress(data))
+    if body.get('version') != FORMAT_VERSION:
+        raise ValueError(f'Unsupported changeset version: {body.get("version")}')
+    return body
+
+
+def apply(conn, body):
+    """Apply a decoded delta in one transaction (idempotent: rows are upserted)."""
+    conn.execute('BEGIN')
+    try:
+        for t in body['tables']:
+            upsert_rows(conn, t['table'], t['columns'], t['rows'], on_conflict='update', key=t['key'])
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
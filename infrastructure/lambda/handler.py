@@ -1,65 +1,425 @@
 """
 Lambda handler: YouTube データ取得 → SQLite 更新 → S3 アップロード → Deploy Hook
 
-EventBridge Scheduler から 15 分間隔で呼び出される。
-データに差分がある場合のみ S3 アップロード + Vercel Deploy Hook を実行。
+WebSub 受信側（websub.py）が SQS に積んだ通知動画 ID をまとめて受け取り、その動画の詳細だけを
+取得する（SQS イベント。変更があればその場で Deploy Hook を呼ぶ）。EventBridge Scheduler からは
+取りこぼし対策として低頻度で呼び出される（差分取得）。event に {"mode": "full"} が渡された場合は
+チャンネル全件を再取得する（日次）。{"action": "deploy"} は DB に触れず、保留中のデプロイの
+期限だけを確認する短い tick（ポーリングが低頻度でも保留分を遅らせないため）。
+行の内容ハッシュに差分がある場合のみ S3 にアップロードし、Vercel Deploy Hook は下記の通りまとめて呼ぶ。
+
+S3 レイアウト（S3_DB_KEY = danin-log.db の場合）:
+  danin-log.db                              フルスナップショット
+  danin-log.manifest.json                   {"snapshot_etag": ..., "head": n, "previous": {...}}
+  danin-log.deltas/<snapshot_etag>/000001.json.gz ...  スナップショット以降の差分（changeset.py）
+
+通常は変更行だけの差分を 1 つ追加し、COMPACT_EVERY 個目で DB 全体を新しい
+スナップショットとしてアップロードして差分列をリセットする。
+manifest の snapshot_etag が実際のスナップショットと一致しない場合（just deploy-data で
+上書きされた等）、その差分列は無効として扱う。
+リセットした差分列はすぐには消さず previous として次のリセットまで残す（実行中のビルドが
+旧 manifest の差分を取得しきれるように）。fetch-data.mjs は manifest を先に読み、
+snapshot_etag を If-Match にしてスナップショットを取得するので、両者が食い違うことはない。
+
+Deploy Hook はまとめて呼ぶ: 変更があると danin-log.deploy-pending.json に最初/最後の変更時刻を
+記録し、最後の変更から DEPLOY_QUIET_SECONDS 経過するか、最初の変更から DEPLOY_MAX_DELAY_SECONDS
+経過した tick で 1 回だけ呼ぶ。呼び出しは tick 冒頭にバックグラウンドで開始し、失敗時は
+マーカーを残して次の tick で再試行する。
+
+シークレットと YouTube クライアントはウォームコンテナ間で再利用する。各 tick の最後に
+ステップ別の所要時間を {"metric": "latency", "cold": ...} の 1 行 JSON で出力する。
 """
 
 import json
 import os
+import shutil
+import time
+import urllib.error
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 import boto3
 
-from youtube_fetcher import fetch_and_update
+import changeset
+from db import get_connection
+from youtube_fetcher import fetch_and_update, get_youtube, has_changes, is_auth_error
 
 S3_BUCKET = os.environ['S3_BUCKET']
 S3_DB_KEY = os.environ['S3_DB_KEY']
 YOUTUBE_SECRET_ARN = os.environ['YOUTUBE_SECRET_ARN']
 DEPLOY_HOOK_SECRET_ARN = os.environ['DEPLOY_HOOK_SECRET_ARN']
+COMPACT_EVERY = int(os.environ.get('COMPACT_EVERY', '24'))
+DEPLOY_QUIET_SECONDS = int(os.environ.get('DEPLOY_QUIET_SECONDS', '1800'))
+DEPLOY_MAX_DELAY_SECONDS = int(os.environ.get('DEPLOY_MAX_DELAY_SECONDS', '7200'))
+DEPLOY_RETRIES = 3
+DEPLOY_BACKOFF_BASE = 1.0
+DEPLOY_TIMEOUT = 10
+DOWNLOAD_CHUNK = 1024 * 1024
+SECRET_TTL = int(os.environ.get('SECRET_TTL_SECONDS', '3600'))
+
+S3_BASE = S3_DB_KEY.rsplit('.', 1)[0]
+S3_MANIFEST_KEY = f'{S3_BASE}.manifest.json'
+S3_DELTA_PREFIX = f'{S3_BASE}.deltas/'
+S3_DEPLOY_PENDING_KEY = f'{S3_BASE}.deploy-pending.json'
 
 DB_PATH = '/tmp/danin-log.db'
+# ウォームコンテナで DB を再利用するための状態記録 {"etag": スナップショット ETag, "seq": 適用済み差分}。
+# 書き込み中は削除しておき、途中でクラッシュした場合は次回必ず再ダウンロードさせる。
+STATE_PATH = DB_PATH + '.state'
 
 s3 = boto3.client('s3')
 secrets = boto3.client('secretsmanager')
 
 
+# ウォームコンテナでは Secrets Manager を SECRET_TTL ごとにしか呼ばない（認証エラー時は即再取得）
+_secret_cache = {}  # arn → (value, fetched_at)
+_cold = True
+
+
 def get_secret(arn):
+    cached = _secret_cache.get(arn)
+    if cached and time.time() - cached[1] < SECRET_TTL:
+        return cached[0]
     resp = secrets.get_secret_value(SecretId=arn)
+    _secret_cache[arn] = (resp['SecretString'], time.time())
     return resp['SecretString']
 
 
-def lambda_handler(event, context):
-    # 1. Get secrets
+def invalidate_secret(arn):
+    _secret_cache.pop(arn, None)
+
+
+class Timings:
+    """ステップごとの所要時間（ms）。cold / warm の比較用に 1 行 JSON でログ出力する。"""
+
+    def __init__(self):
+        self.ms = {}
+        self._start = self._last = time.perf_counter()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.ms[name] = round((now - self._last) * 1000)
+        self._last = now
+
+    def log(self, cold):
+        self.ms['total'] = round((time.perf_counter() - self._start) * 1000)
+        print(json.dumps({'metric': 'latency', 'cold': cold, **self.ms}))
+
+
+# ---------- Snapshot + delta chain ----------
+
+def delta_key(snapshot_etag, seq):
+    return f'{S3_DELTA_PREFIX}{snapshot_etag.strip(chr(34))}/{seq:06d}.json.gz'
+
+
+def load_manifest():
+    """S3 の manifest {'snapshot_etag', 'head', 'previous'}。未作成なら None"""
+    try:
+        body = s3.get_object(Bucket=S3_BUCKET, Key=S3_MANIFEST_KEY)['Body'].read()
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(body)
+
+
+def save_manifest(manifest):
+    s3.put_object(
+        Bucket=S3_BUCKET, Key=S3_MANIFEST_KEY,
+        Body=json.dumps(manifest).encode(), ContentType='application/json',
+    )
+
+
+def rebase_manifest(manifest, snapshot_etag):
+    """snapshot_etag 上の空の差分列を返す。旧差分列は previous として 1 世代残す。
+
+    旧 manifest を読んだビルド（fetch-data.mjs）がまだ差分を取得中かもしれないので、
+    消すのはその 1 つ前の世代（前回の rebase で previous にしたもの）だけ。
+    """
+    if manifest.get('previous'):
+        delete_deltas(manifest['previous'])
+    previous = {'snapshot_etag': manifest['snapshot_etag'], 'head': manifest['head']}
+    return {'snapshot_etag': snapshot_etag, 'head': 0, 'previous': previous}
+
+
+def delete_deltas(manifest):
+    keys = [{'Key': delta_key(manifest['snapshot_etag'], seq)} for seq in range(1, manifest['head'] + 1)]
+    for i in range(0, len(keys), 1000):
+        s3.delete_objects(Bucket=S3_BUCKET, Delete={'Objects': keys[i:i + 1000], 'Quiet': True})
+
+
+def read_state():
+    try:
+        return json.loads(Path(STATE_PATH).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def mark_db_dirty():
+    Path(STATE_PATH).unlink(missing_ok=True)
+
+
+def remove_db_files():
+    """DB 本体と -journal / -wal / -shm を削除（残っていると新しい DB に巻き戻し / 再生されるため）"""
+    for suffix in ('', '-journal', '-wal', '-shm'):
+        Path(DB_PATH + suffix).unlink(missing_ok=True)
+
+
+def mark_db_clean(etag, seq):
+    Path(STATE_PATH).write_text(json.dumps({'etag': etag, 'seq': seq}))
+
+
+def sync_db():
+    """/tmp の DB を S3 の最新（スナップショット + 差分列）に揃えて manifest を返す。
+
+    ウォームコピーが同じスナップショット上にあれば、未適用の差分だけを取得する。
+    """
+    etag = s3.head_object(Bucket=S3_BUCKET, Key=S3_DB_KEY)['ETag']
+    manifest = load_manifest()
+    if manifest is None:
+        manifest = {'snapshot_etag': etag, 'head': 0}
+    elif manifest['snapshot_etag'] != etag:
+        # スナップショットが外から差し替えられた（just deploy-data）
+        print(f'Manifest belongs to another snapshot; starting a new chain (keeping {manifest["head"]} old deltas)')
+        manifest = rebase_manifest(manifest, etag)
+        save_manifest(manifest)
+
+    state = read_state()
+    if Path(DB_PATH).exists() and state and state['etag'] == etag and state['seq'] <= manifest['head']:
+        applied = state['seq']
+        print(f'Reusing warm {DB_PATH} (ETag {etag}, seq {applied})')
+    else:
+        mark_db_dirty()
+        print(f'Downloading {S3_DB_KEY} from {S3_BUCKET}')
+        tmp_path = DB_PATH + '.download'
+        # head_object 以降に差し替わっていたら 412 で失敗させる（manifest と食い違う DB を使わない）
+        body = s3.get_object(Bucket=S3_BUCKET, Key=S3_DB_KEY, IfMatch=etag)['Body']
+        with open(tmp_path, 'wb') as f:
+            shutil.copyfileobj(body, f, DOWNLOAD_CHUNK)
+        remove_db_files()
+        os.replace(tmp_path, DB_PATH)
+        applied = 0
+
+    if applied < manifest['head']:
+        mark_db_dirty()
+        conn = get_connection(workload='bulk', db_path=DB_PATH)
+        for seq in range(applied + 1, manifest['head'] + 1):
+            body = s3.get_object(Bucket=S3_BUCKET, Key=delta_key(etag, seq))['Body'].read()
+            changeset.apply(conn, changeset.decode(body))
+        conn.close()
+        print(f'Applied deltas {applied + 1}..{manifest["head"]}')
+
+    mark_db_clean(etag, manifest['head'])
+    return manifest
+
+
+def publish(changes_log, manifest):
+    """変更を S3 に反映。通常は差分を 1 つ追加、COMPACT_EVERY 個目でスナップショットを作り直す。"""
+    seq = manifest['head'] + 1
+    if seq >= COMPACT_EVERY:
+        print(f'Compacting: uploading {S3_DB_KEY} to {S3_BUCKET}')
+        conn = get_connection(workload='bulk', db_path=DB_PATH)
+        conn.execute('PRAGMA journal_mode = DELETE')  # Vercel が読み取り専用で開けるように
+        conn.close()
+        s3.upload_file(DB_PATH, S3_BUCKET, S3_DB_KEY)
+        etag = s3.head_object(Bucket=S3_BUCKET, Key=S3_DB_KEY)['ETag']
+        save_manifest(rebase_manifest(manifest, etag))
+        mark_db_clean(etag, 0)
+        return {'snapshot': True, 'seq': 0}
+
+    key = delta_key(manifest['snapshot_etag'], seq)
+    body = changes_log.encode(seq, manifest['snapshot_etag'])
+    print(f'Uploading delta {key} ({len(body)} bytes)')
+    s3.put_object(Bucket=S3_BUCKET, Key=key, Body=body, ContentType='application/gzip')
+    save_manifest({**manifest, 'head': seq})
+    mark_db_clean(manifest['snapshot_etag'], seq)
+    return {'snapshot': False, 'seq': seq}
+
+
+# ---------- Deploy hook coalescing ----------
+
+def load_pending_deploy():
+    """{'first_change_at', 'last_change_at'} (epoch 秒) or None"""
+    try:
+        body = s3.get_object(Bucket=S3_BUCKET, Key=S3_DEPLOY_PENDING_KEY)['Body'].read()
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(body)
+
+
+def save_pending_deploy(pending):
+    if pending is None:
+        s3.delete_object(Bucket=S3_BUCKET, Key=S3_DEPLOY_PENDING_KEY)
+    else:
+        s3.put_object(
+            Bucket=S3_BUCKET, Key=S3_DEPLOY_PENDING_KEY,
+            Body=json.dumps(pending).encode(), ContentType='application/json',
+        )
+
+
+def deploy_due(pending, now):
+    return pending is not None and (
+        now - pending['last_change_at'] >= DEPLOY_QUIET_SECONDS
+        or now - pending['first_change_at'] >= DEPLOY_MAX_DELAY_SECONDS
+    )
+
+
+def update_pending_deploy(pending, published, notified, deployed):
+    """tick の結果から保留マーカーを更新して返す。
+
+    deployed after publish (notified) → everything is live
+    deployed at tick start → earlier changes are live; keep only this tick's changes (if any)
+    not deployed (not due or failed) → keep the earliest change time
+    """
+    now = time.time()
+    next_pending = None if deployed else pending
+    if published and not (notified and deployed):
+        first = next_pending['first_change_at'] if next_pending else now
+        next_pending = {'first_change_at': first, 'last_change_at': now}
+    if next_pending != pending:
+        save_pending_deploy(next_pending)
+    return next_pending
+
+
+def trigger_deploy(url):
+    """Deploy Hook を POST。5xx / 通信エラーは指数バックオフで再試行。成功なら True。"""
+    for attempt in range(DEPLOY_RETRIES):
+        try:
+            req = urllib.request.Request(url, method='POST', data=b'')
+            with urllib.request.urlopen(req, timeout=DEPLOY_TIMEOUT) as resp:
+                print(f'Deploy Hook response: {resp.status}')
+                return True
+        except urllib.error.HTTPError as e:
+            if e.code < 500:
+                print(f'Deploy Hook failed: {e.code}')
+                return False
+            print(f'Deploy Hook error {e.code} (attempt {attempt + 1}/{DEPLOY_RETRIES})')
+        except (urllib.error.URLError, TimeoutError) as e:
+            print(f'Deploy Hook error {e} (attempt {attempt + 1}/{DEPLOY_RETRIES})')
+        if attempt + 1 < DEPLOY_RETRIES:
+            time.sleep(DEPLOY_BACKOFF_BASE * 2 ** attempt)
+    return False
+
+
+def notified_video_ids(event):
+    """SQS イベント（websub.py が積んだ {"video_ids": [...]}）の動画 ID。SQS 以外なら None"""
+    records = (event or {}).get('Records')
+    if not records:
+        return None
+    ids = []
+    for record in records:
+        ids.extend(json.loads(record['body'])['video_ids'])
+    return ids
+
+
+def fetch_with_key_refresh(full, changes_log, video_ids=None):
+    """fetch_and_update。API キーが無効ならシークレットを取り直して 1 回だけ再試行。"""
     api_key = get_secret(YOUTUBE_SECRET_ARN)
+    try:
+        return fetch_and_update(api_key, DB_PATH, full=full, changeset=changes_log, video_ids=video_ids)
+    except Exception as e:
+        if not is_auth_error(e):
+            raise
+        invalidate_secret(YOUTUBE_SECRET_ARN)
+        fresh = get_secret(YOUTUBE_SECRET_ARN)
+        if fresh == api_key:
+            raise
+        print('YouTube API key rejected; retrying with refreshed secret')
+        return fetch_and_update(fresh, DB_PATH, full=full, changeset=changes_log, video_ids=video_ids)
+
+
+def deploy_only(pending, deploy_hook_url, timings, cold):
+    """Deploy-check tick（{"action": "deploy"}）: DB には触れず、期限が来ていればフックだけ呼ぶ"""
+    deployed = False
+    if deploy_due(pending, time.time()):
+        print('Triggering Vercel Deploy Hook')
+        deployed = trigger_deploy(deploy_hook_url)
+        if deployed:
+            save_pending_deploy(None)
+        else:
+            invalidate_secret(DEPLOY_HOOK_SECRET_ARN)
+    timings.lap('deploy')
+    timings.log(cold)
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'deployed': deployed, 'deploy_pending': pending is not None and not deployed}),
+    }
+
+
+def lambda_handler(event, context):
+    global _cold
+    cold, _cold = _cold, False
+    timings = Timings()
+    event = event or {}
+
+    # 1. Get secrets (cached across warm invocations) and the YouTube client (built once per container)
     deploy_hook_url = get_secret(DEPLOY_HOOK_SECRET_ARN)
+    if event.get('action') == 'deploy':
+        return deploy_only(load_pending_deploy(), deploy_hook_url, timings, cold)
+    api_key = get_secret(YOUTUBE_SECRET_ARN)
+    timings.lap('secrets')
+    get_youtube(api_key)
+    timings.lap('client')
+
+    # SQS batch from WebSub → notified videos only (deployed right after publish);
+    # schedule → incremental / full (deploys coalesced)
+    full = event.get('mode') == 'full'
+    video_ids = notified_video_ids(event)
+    notified = video_ids is not None
+
+    # 2. Fire a coalesced deploy for earlier changes in the background if it is due
+    #    (the site builds from what is already on S3, so it need not wait for this tick)
+    started = time.time()
+    pending = load_pending_deploy()
+    pool = ThreadPoolExecutor(max_workers=1)
+    deploy = None
+    published = {}
+    if not notified and deploy_due(pending, started):
+        print('Triggering Vercel Deploy Hook')
+        deploy = pool.submit(trigger_deploy, deploy_hook_url)
 
-    # 2. Download DB from S3
-    print(f'Downloading {S3_DB_KEY} from {S3_BUCKET}')
-    s3.download_file(S3_BUCKET, S3_DB_KEY, DB_PATH)
+    try:
+        # 3. Bring /tmp DB up to date with S3 (snapshot + deltas, reusing warm copy)
+        manifest = sync_db()
+        timings.lap('sync_db')
 
-    # 3. Fetch YouTube data and update DB
-    added = fetch_and_update(api_key, DB_PATH)
+        # 4. Fetch YouTube data and update DB, recording written rows
+        changes_log = changeset.Changeset()
+        mark_db_dirty()
+        changes = fetch_with_key_refresh(full, changes_log, video_ids)
+        timings.lap('fetch')
 
-    # 4. Skip if no changes
-    if added == 0:
-        print('No new videos. Skipping S3 upload and deploy hook.')
-        return {
-            'statusCode': 200,
-            'body': json.dumps({'added': 0, 'deployed': False}),
-        }
+        # 5. Upload delta (or a compacted snapshot) to S3
+        if has_changes(changes):
+            published = publish(changes_log, manifest)
+        else:
+            mark_db_clean(manifest['snapshot_etag'], manifest['head'])
+            print('No changes. Skipping S3 upload.')
+        timings.lap('publish')
 
-    # 5. Upload updated DB to S3
-    print(f'Uploading {S3_DB_KEY} to {S3_BUCKET}')
-    s3.upload_file(DB_PATH, S3_BUCKET, S3_DB_KEY)
+        # 新着通知は待たずに反映（このバッチと保留中の変更をまとめて 1 回）
+        if notified and (published or deploy_due(pending, time.time())):
+            print('Triggering Vercel Deploy Hook (notified)')
+            deploy = pool.submit(trigger_deploy, deploy_hook_url)
+    finally:
+        deployed = deploy.result() if deploy else False
+        pool.shutdown()
+        timings.lap('deploy_wait')
+        if deploy and not deployed:
+            # フック URL が再発行された可能性があるので次の tick で取り直す
+            invalidate_secret(DEPLOY_HOOK_SECRET_ARN)
 
-    # 6. Trigger Vercel Deploy Hook
-    print('Triggering Vercel Deploy Hook')
-    req = urllib.request.Request(deploy_hook_url, method='POST', data=b'')
-    with urllib.request.urlopen(req) as resp:
-        print(f'Deploy Hook response: {resp.status}')
+        # 6. Update the pending-deploy marker
+        #    (tick が例外で終わっても、出ていったデプロイの分はここで消す)
+        next_pending = update_pending_deploy(pending, published, notified, deployed)
+        timings.lap('marker')
+    timings.log(cold)
 
     return {
         'statusCode': 200,
-        'body': json.dumps({'added': added, 'deployed': True}),
+        'body': json.dumps({
+            'changes': changes,
+            'deployed': deployed,
+            'deploy_pending': next_pending is not None,
+            **published,
+        }),
     }
@@ -0,0 +1,163 @@
+"""
+WebSub (PubSubHubbub) コールバック: チャンネルの Atom フィードの push 通知を受け取り、
+通知された動画 ID だけを SQS に積む（data updater がまとめて fetch_video_details のみで反映）。
+
+Lambda Function URL から呼ばれる:
+  GET  ?hub.mode=subscribe&hub.topic=...&hub.challenge=...  購読確認（challenge をそのまま返す）
+  POST Atom XML + X-Hub-Signature: sha1=<hex>               署名検証 → 動画 ID を enqueue
+
+購読の lease は有限なので、EventBridge Scheduler から
+{"action": "subscribe", "callback": "<Function URL>"} で日次に再購読する。
+
+署名が一致しない通知も 2xx を返して無視する（WebSub 仕様。4xx だと hub が再送し続ける）。
+QUEUE_URL 未設定時（ローカル）は enqueue せずに出力のみ。WEBSUB_SECRET を直接渡すと
+Secrets Manager を使わない（infrastructure/scripts/websub_local_hub.py 用）。
+"""
+
+import base64
+import hmac
+import json
+import os
+import time
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+
+NOEL_CHANNEL_ID = 'UCdyqAaZDKHXg4Ahi7VENThQ'
+TOPIC_URL = f'https://www.youtube.com/xml/feeds/videos.xml?channel_id={NOEL_CHANNEL_ID}'
+HUB_URL = 'https://pubsubhubbub.appspot.com/subscribe'
+LEASE_SECONDS = 5 * 24 * 3600
+HUB_TIMEOUT = 10
+
+QUEUE_URL = os.environ.get('QUEUE_URL', '')
+WEBSUB_SECRET_ARN = os.environ.get('WEBSUB_SECRET_ARN', '')
+SECRET_TTL = int(os.environ.get('SECRET_TTL_SECONDS', '3600'))
+
+NS = {
+    'atom': 'http://www.w3.org/2005/Atom',
+    'yt': 'http://www.youtube.com/xml/schemas/2015',
+    'at': 'http://purl.org/atompub/tombstones/1.0',
+}
+SIGNATURE_ALGORITHMS = {'sha1', 'sha256', 'sha384', 'sha512'}
+
+_clients = {}
+_secret_cache = None  # (value, fetched_at)
+
+
+def client(name):
+    # boto3 はローカル（QUEUE_URL / WEBSUB_SECRET_ARN 未設定）では不要
+    if name not in _clients:
+        import boto3
+        _clients[name] = boto3.client(name)
+    return _clients[name]
+
+
+def get_hub_secret():
+    global _secret_cache
+    if 'WEBSUB_SECRET' in os.environ:
+        return os.environ['WEBSUB_SECRET']
+    if _secret_cache and time.time() - _secret_cache[1] < SECRET_TTL:
+        return _secret_cache[0]
+    value = client('secretsmanager').get_secret_value(SecretId=WEBSUB_SECRET_ARN)['SecretString']
+    _secret_cache = (value, time.time())
+    return value
+
+
+def response(status, body='', content_type='text/plain'):
+    return {'statusCode': status, 'headers': {'Content-Type': content_type}, 'body': body}
+
+
+# ---------- Subscription ----------
+
+def verify_intent(params):
+    """hub からの購読確認。自分のトピックなら challenge を返す"""
+    mode = params.get('hub.mode')
+    if mode not in ('subscribe', 'unsubscribe') or params.get('hub.topic') != TOPIC_URL:
+        print(f'Rejecting verification: mode={mode} topic={params.get("hub.topic")}')
+        return response(404)
+    print(f'Verified {mode} (lease {params.get("hub.lease_seconds")}s)')
+    return response(200, params.get('hub.challenge', ''))
+
+
+def subscribe(callback, mode='subscribe'):
+    """hub に購読（再購読）を要求。確認は hub から callback への GET で非同期に行われる"""
+    data = urllib.parse.urlencode({
+        'hub.callback': callback,
+        'hub.topic': TOPIC_URL,
+        'hub.mode': mode,
+        'hub.verify': 'async',
+        'hub.secret': get_hub_secret(),
+        'hub.lease_seconds': LEASE_SECONDS,
+    }).encode()
+    req = urllib.request.Request(HUB_URL, data=data, method='POST')
+    with urllib.request.urlopen(req, timeout=HUB_TIMEOUT) as resp:
+        print(f'Hub {mode} response: {resp.status}')
+        return resp.status
+
+
+# ---------- Notification ----------
+
+def signature_valid(body, header, secret):
+    """X-Hub-Signature: <algo>=<hex HMAC of raw body>"""
+    algo, _, digest = (header or '').partition('=')
+    if algo not in SIGNATURE_ALGORITHMS or not digest:
+        return False
+    expected = hmac.new(secret.encode(), body, algo).hexdigest()
+    return hmac.compare_digest(expected, digest.lower())
+
+
+def parse_feed(body):
+    """Atom フィードからこのチャンネルの動画 ID を返す（削除通知は無視）"""
+    root = ET.fromstring(body)
+    ids = []
+    for entry in root.findall('atom:entry', NS):
+        video_id = entry.findtext('yt:videoId', namespaces=NS)
+        channel_id = entry.findtext('yt:channelId', namespaces=NS)
+        if video_id and channel_id == NOEL_CHANNEL_ID:
+            ids.append(video_id)
+    for deleted in root.findall('at:deleted-entry', NS):
+        print(f'Ignoring deleted entry: {deleted.get("ref")}')
+    return ids
+
+
+def enqueue(video_ids):
+    body = json.dumps({'video_ids': video_ids})
+    if not QUEUE_URL:
+        print(f'QUEUE_URL not set; would enqueue {body}')
+        return
+    client('sqs').send_message(QueueUrl=QUEUE_URL, MessageBody=body)
+    print(f'Enqueued {len(video_ids)} videos: {", ".join(video_ids)}')
+
+
+def receive_notification(event):
+    body = event.get('body') or ''
+    body = base64.b64decode(body) if event.get('isBase64Encoded') else body.encode()
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+
+    if not signature_valid(body, headers.get('x-hub-signature'), get_hub_secret()):
+        print('Invalid X-Hub-Signature; ignoring notification')
+        return response(202)
+
+    try:
+        video_ids = parse_feed(body)
+    except ET.ParseError as e:
+        print(f'Malformed feed: {e}')
+        return response(202)
+    if video_ids:
+        enqueue(video_ids)
+    return response(202)
+
+
+def lambda_handler(event, context):
+    # EventBridge Scheduler: 定期的な再購読
+    if event.get('action') in ('subscribe', 'unsubscribe'):
+        status = subscribe(event['callback'], event['action'])
+        return {'statusCode': status}
+
+    # Function URL
+    method = event['requestContext']['http']['method']
+    if method == 'GET':
+        return verify_intent(event.get('queryStringParameters') or {})
+    if method == 'POST':
+        return receive_notification(event)
+    return response(405)
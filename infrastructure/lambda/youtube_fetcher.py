@@ -1,18 +1,60 @@
 """
 YouTube Data API から動画データを取得し、SQLite を更新する。
 tools/scripts/youtube_data_fetcher.py のコアロジックを Lambda 用に抽出。
+DB 接続・書き込みは tools/scripts/db.py、API 呼び出し（リトライ・クォータ集計）は
+tools/scripts/youtube_api.py を共有する（package-lambda.sh で同梱）。
 """
 
+import hashlib
+import json
 import re
-import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+from db import analyze, get_connection, optimize, upsert_rows
+from youtube_api import execute, quota
 
 NOEL_CHANNEL_ID = 'UCdyqAaZDKHXg4Ahi7VENThQ'
 
 VIDEO_TYPE_STREAM = 1
 VIDEO_TYPE_VIDEO = 2
 
+# Incremental mode: re-fetch streams started within this window (live/upcoming/just archived)
+RECENT_WINDOW = timedelta(days=2)
+RECENT_LIMIT = 50
+
+# videos().list batches run concurrently
+MAX_WORKERS = 4
+
+
+_youtube = {}
+
+
+def get_youtube(api_key):
+    """YouTube client, built once per container.
+
+    static_discovery=True reads the discovery document bundled with
+    google-api-python-client, so building never hits the discovery endpoint.
+    """
+    if api_key not in _youtube:
+        _youtube.clear()  # API key rotated
+        _youtube[api_key] = build(
+            'youtube', 'v3', developerKey=api_key, static_discovery=True, cache_discovery=False,
+        )
+    return _youtube[api_key]
+
+
+def is_auth_error(e):
+    """HttpError caused by an invalid/revoked API key (not quota or transient errors)."""
+    return (
+        isinstance(e, HttpError)
+        and e.resp.status in (400, 401, 403)
+        and any(s in (e.content or b'') for s in (b'keyInvalid', b'API key not valid', b'API_KEY_INVALID'))
+    )
+
 
 def iso_duration_to_hhmmss(d):
     """ISO 8601 duration (PT1H30M15S) -> HH:MM:SS"""
@@ -23,10 +65,10 @@ def iso_duration_to_hhmmss(d):
 
 
 def fetch_channel_info(youtube, channel_id):
-    resp = youtube.channels().list(
+    resp = execute(youtube.channels().list(
         part='snippet,brandingSettings',
         id=channel_id,
-    ).execute()
+    ))
 
     if not resp['items']:
         print(f'  Warning: channel {channel_id} not found')
@@ -46,8 +88,12 @@ def fetch_channel_info(youtube, channel_id):
     }
 
 
-def fetch_all_video_ids(youtube, channel_id):
-    resp = youtube.channels().list(part='contentDetails', id=channel_id).execute()
+def fetch_all_video_ids(youtube, channel_id, known_ids=None):
+    """Uploads playlist -> video IDs (newest first).
+
+    If known_ids is given, stop paging at the first page whose IDs are all known.
+    """
+    resp = execute(youtube.channels().list(part='contentDetails', id=channel_id))
     if not resp['items']:
         return []
 
@@ -56,15 +102,18 @@ def fetch_all_video_ids(youtube, channel_id):
     page_token = None
 
     while True:
-        resp = youtube.playlistItems().list(
+        resp = execute(youtube.playlistItems().list(
             part='snippet',
             playlistId=playlist_id,
             maxResults=50,
             pageToken=page_token,
-        ).execute()
+        ))
+
+        page_ids = [item['snippet']['resourceId']['videoId'] for item in resp['items']]
+        video_ids.extend(page_ids)
 
-        for item in resp['items']:
-            video_ids.append(item['snippet']['resourceId']['videoId'])
+        if known_ids is not None and all(vid in known_ids for vid in page_ids):
+            break
 
         page_token = resp.get('nextPageToken')
         if not page_token:
@@ -74,18 +123,38 @@ def fetch_all_video_ids(youtube, channel_id):
     return video_ids
 
 
+def load_recent_stream_ids(conn, now=None):
+    """Live/upcoming or recently started streams whose details may still change."""
+    now = now or datetime.now(timezone.utc)
+    since = (now - RECENT_WINDOW).strftime('%Y-%m-%dT%H:%M:%SZ')
+    rows = conn.execute(
+        '''SELECT v.id FROM videos v
+           LEFT JOIN stream_details sd ON v.id = sd.video_id
+           WHERE v.channel_id = ?
+             AND (v.duration = '00:00:00' OR sd.started_at >= ?)
+           ORDER BY v.published_at DESC
+           LIMIT ?''',
+        (NOEL_CHANNEL_ID, since, RECENT_LIMIT),
+    ).fetchall()
+    return [r['id'] for r in rows]
+
+
 def fetch_video_details(youtube, video_ids, channel_id, premiere_ids):
     videos = []
     vv_types = []
     stream_details = []
 
-    for i in range(0, len(video_ids), 50):
-        batch = video_ids[i : i + 50]
-        resp = youtube.videos().list(
+    def fetch_batch(batch):
+        return execute(youtube.videos().list(
             part='snippet,contentDetails,liveStreamingDetails',
             id=','.join(batch),
-        ).execute()
+        ))
+
+    batches = [video_ids[i : i + 50] for i in range(0, len(video_ids), 50)]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        responses = list(pool.map(fetch_batch, batches))
 
+    for resp in responses:
         for v in resp['items']:
             vid = v['id']
             snippet = v['snippet']
@@ -121,27 +190,81 @@ def fetch_video_details(youtube, video_ids, channel_id, premiere_ids):
     return videos, vv_types, stream_details
 
 
-def fetch_and_update(api_key, db_path):
-    """YouTube API からデータを取得し DB を更新。更新件数を返す。"""
-    youtube = build('youtube', 'v3', developerKey=api_key)
+def row_hash(values):
+    """Stable content hash of a row's column values."""
+    return hashlib.sha1(json.dumps(list(values), ensure_ascii=False).encode()).hexdigest()
 
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    conn.execute('PRAGMA foreign_keys = ON')
+
+def upsert_changed(conn, table, key, columns, rows, changeset=None):
+    """Upsert only rows whose content differs from the stored row.
+
+    Changed rows are also recorded to `changeset` when given.
+    Returns {'inserted': n, 'updated': n, 'unchanged': n}.
+    """
+    stored = {
+        r[0]: row_hash(r[1:])
+        for r in conn.execute(f'SELECT {key}, {", ".join(columns)} FROM {table}').fetchall()
+    }
+
+    changed = []
+    for row in rows:
+        values = [row[c] for c in columns]
+        if stored.get(row[key]) != row_hash(values):
+            changed.append((row[key], *values))
+
+    result = upsert_rows(conn, table, [key, *columns], changed, on_conflict='update', key=key)
+    if changeset is not None:
+        changeset.record(table, [key], [key, *columns], changed)
+    return {
+        'inserted': result['inserted'],
+        'updated': result['updated'],
+        'unchanged': len(rows) - len(changed),
+    }
+
+
+def has_changes(changes):
+    return any(c['inserted'] or c['updated'] for c in changes.values())
+
+
+def fetch_and_update(api_key, db_path, full=False, changeset=None, video_ids=None):
+    """YouTube API からデータを取得し DB を更新。
+
+    テーブルごとの {'inserted', 'updated', 'unchanged'} 件数を返す。
+    changeset (changeset.Changeset) を渡すと、書き込んだ行をそこに記録する。
+
+    full=False (incremental): new uploads + recent streams only.
+    full=True: re-crawl the whole uploads playlist (reconcile).
+    video_ids: WebSub で通知された動画だけを取得（プレイリスト走査なし）。
+    """
+    youtube = get_youtube(api_key)
+    quota.reset()
+
+    # /tmp の使い捨てコピーなので bulk（クラッシュ時は handler が再ダウンロードさせる）
+    conn = get_connection(workload='bulk', db_path=db_path)
 
     # Premiere video IDs
     premiere_rows = conn.execute('SELECT video_id FROM premiere_videos').fetchall()
     premiere_ids = {r['video_id'] for r in premiere_rows}
 
-    # Count before update
-    count_before = conn.execute('SELECT COUNT(*) FROM videos').fetchone()[0]
-    print(f'Videos before: {count_before}')
-
     # Fetch from YouTube API
-    video_ids = fetch_all_video_ids(youtube, NOEL_CHANNEL_ID)
+    if video_ids is not None:
+        video_ids = list(dict.fromkeys(video_ids))
+        print(f'Mode: notified ({len(video_ids)} videos)')
+    elif full:
+        print('Mode: full')
+        video_ids = fetch_all_video_ids(youtube, NOEL_CHANNEL_ID)
+    else:
+        known_ids = {r['id'] for r in conn.execute('SELECT id FROM videos').fetchall()}
+        uploaded_ids = fetch_all_video_ids(youtube, NOEL_CHANNEL_ID, known_ids)
+        new_ids = [vid for vid in uploaded_ids if vid not in known_ids]
+        recent_ids = [vid for vid in load_recent_stream_ids(conn) if vid not in new_ids]
+        print(f'Mode: incremental (new: {len(new_ids)}, recent: {len(recent_ids)})')
+        video_ids = new_ids + recent_ids
+
     if not video_ids:
         conn.close()
-        return 0
+        print(f'Quota used: {quota.used} units')
+        return {}
 
     new_videos, new_vv_types, new_stream_details = fetch_video_details(
         youtube, video_ids, NOEL_CHANNEL_ID, premiere_ids
@@ -155,48 +278,34 @@ def fetch_and_update(api_key, db_path):
         if info:
             new_channels.append(info)
 
-    # Write to DB (upsert)
+    # Write to DB (upsert changed rows only)
     conn.execute('BEGIN')
-
-    for ch in new_channels:
-        conn.execute(
-            '''INSERT INTO channels (id, title, handle, icon_url) VALUES (?, ?, ?, ?)
-               ON CONFLICT(id) DO UPDATE SET
-                 title=excluded.title, handle=excluded.handle, icon_url=excluded.icon_url''',
-            (ch['id'], ch['title'], ch['handle'], ch['icon_url']),
-        )
-
-    for v in new_videos:
-        conn.execute(
-            '''INSERT INTO videos (id, title, thumbnail_url, duration, channel_id, published_at) VALUES (?, ?, ?, ?, ?, ?)
-               ON CONFLICT(id) DO UPDATE SET
-                 title=excluded.title, thumbnail_url=excluded.thumbnail_url,
-                 duration=excluded.duration, channel_id=excluded.channel_id,
-                 published_at=excluded.published_at''',
-            (v['id'], v['title'], v['thumbnail_url'], v['duration'], v['channel_id'], v['published_at']),
-        )
-
-    for vvt in new_vv_types:
-        conn.execute(
-            '''INSERT INTO video_video_types (video_id, video_type_id) VALUES (?, ?)
-               ON CONFLICT(video_id) DO UPDATE SET
-                 video_type_id=excluded.video_type_id''',
-            (vvt['video_id'], vvt['video_type_id']),
-        )
-
-    for sd in new_stream_details:
-        conn.execute(
-            '''INSERT INTO stream_details (video_id, started_at) VALUES (?, ?)
-               ON CONFLICT(video_id) DO UPDATE SET
-                 started_at=excluded.started_at''',
-            (sd['video_id'], sd['started_at']),
-        )
-
+    changes = {
+        'channels': upsert_changed(
+            conn, 'channels', 'id', ['title', 'handle', 'icon_url'], new_channels, changeset,
+        ),
+        'videos': upsert_changed(
+            conn, 'videos', 'id',
+            ['title', 'thumbnail_url', 'duration', 'channel_id', 'published_at'],
+            new_videos, changeset,
+        ),
+        'video_video_types': upsert_changed(
+            conn, 'video_video_types', 'video_id', ['video_type_id'], new_vv_types, changeset,
+        ),
+        'stream_details': upsert_changed(
+            conn, 'stream_details', 'video_id', ['started_at'], new_stream_details, changeset,
+        ),
+    }
     conn.execute('COMMIT')
-
-    count_after = conn.execute('SELECT COUNT(*) FROM videos').fetchone()[0]
+    if has_changes(changes):
+        # 毎時の差分は数行なので全表 ANALYZE はしない（日次の full だけ取り直す）
+        if full:
+            analyze(conn)
+        else:
+            optimize(conn)
     conn.close()
 
-    added = count_after - count_before
-    print(f'Videos after: {count_after} (added: {added})')
-    return added
+    for table, c in changes.items():
+        print(f'{table}: inserted={c["inserted"]} updated={c["updated"]} unchanged={c["unchanged"]}')
+    print(f'Quota used: {quota.used} units')
+    return changes
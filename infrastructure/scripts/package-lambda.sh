@@ -28,6 +28,10 @@ pip3 install -r "$LAMBDA_DIR/requirements.txt" -t "$BUILD_DIR" \
 echo "Copying Lambda source..."
 cp "$LAMBDA_DIR/handler.py" "$BUILD_DIR/"
 cp "$LAMBDA_DIR/youtube_fetcher.py" "$BUILD_DIR/"
+cp "$LAMBDA_DIR/changeset.py" "$BUILD_DIR/"
+cp "$LAMBDA_DIR/websub.py" "$BUILD_DIR/"
+cp "$LAMBDA_DIR/../../tools/scripts/db.py" "$BUILD_DIR/"
+cp "$LAMBDA_DIR/../../tools/scripts/youtube_api.py" "$BUILD_DIR/"
 
 # Create zip
 echo "Creating zip..."
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+WebSub hub のローカル代役: lambda/websub.py にサンプルの Atom 通知を送って動作確認する。
+
+  1. 購読確認（GET + hub.challenge）が echo されるか
+  2. 正しく署名した通知 → 動画 ID が enqueue される（QUEUE_URL 未設定なら出力のみ）
+  3. 不正な署名の通知 → 2xx で無視される
+
+--callback を省略すると websub.lambda_handler をローカルの HTTP サーバで起動し
+（Function URL のイベント形式に変換）、そこに送る。デプロイ済みの Function URL を
+指定する場合は --secret に Secrets Manager と同じ値を渡す。
+
+使い方:
+  python3 infrastructure/scripts/websub_local_hub.py
+  python3 infrastructure/scripts/websub_local_hub.py --video-id abc123XYZ00 --video-id def456UVW11
+  python3 infrastructure/scripts/websub_local_hub.py --callback https://xxx.lambda-url.ap-northeast-1.on.aws/ --secret ...
+"""
+
+import argparse
+import hashlib
+import hmac
+import os
+import secrets
+import sys
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'lambda'))
+
+SAMPLE_VIDEO_ID = 'dQw4w9WgXcQ'
+
+FEED_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom">
+  <link rel="hub" href="https://pubsubhubbub.appspot.com"/>
+  <link rel="self" href="{topic}"/>
+  <title>YouTube video feed</title>
+  <updated>2024-01-01T00:00:00+00:00</updated>
+{entries}
+</feed>
+'''
+
+ENTRY_TEMPLATE = '''  <entry>
+    <id>yt:video:{video_id}</id>
+    <yt:videoId>{video_id}</yt:videoId>
+    <yt:channelId>{channel_id}</yt:channelId>
+    <title>sample {video_id}</title>
+    <link rel="alternate" href="https://www.youtube.com/watch?v={video_id}"/>
+    <published>2024-01-01T00:00:00+00:00</published>
+    <updated>2024-01-01T00:00:00+00:00</updated>
+  </entry>'''
+
+
+def sample_feed(websub, video_ids):
+    entries = [ENTRY_TEMPLATE.format(video_id=v, channel_id=websub.NOEL_CHANNEL_ID) for v in video_ids]
+    # 他チャンネルの通知は無視されるはず
+    entries.append(ENTRY_TEMPLATE.format(video_id='otherChan00', channel_id='UCxxxxxxxxxxxxxxxxxxxxxx'))
+    return FEED_TEMPLATE.format(topic=websub.TOPIC_URL, entries='\n'.join(entries)).encode()
+
+
+def serve_locally(websub):
+    """websub.lambda_handler を Function URL 風のイベントで呼ぶ HTTP サーバを起動し、URL を返す"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def _invoke(self, method):
+            url = urllib.parse.urlsplit(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            event = {
+                'requestContext': {'http': {'method': method, 'path': url.path}},
+                'headers': dict(self.headers),
+                'queryStringParameters': dict(urllib.parse.parse_qsl(url.query)) or None,
+                'body': self.rfile.read(length).decode() if length else None,
+                'isBase64Encoded': False,
+            }
+            result = websub.lambda_handler(event, None)
+            body = (result.get('body') or '').encode()
+            self.send_response(result['statusCode'])
+            for k, v in (result.get('headers') or {}).items():
+                self.send_header(k, v)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._invoke('GET')
+
+        def do_POST(self):
+            self._invoke('POST')
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}/'
+
+
+def request(url, data=None, headers=None):
+    req = urllib.request.Request(url, data=data, headers=headers or {}, method='POST' if data else 'GET')
+    try:
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            return resp.status, resp.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode()
+
+
+def check(label, ok):
+    print(f'{"OK" if ok else "NG"} {label}')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WebSub hub のローカル代役')
+    parser.add_argument('--callback', help='送信先 URL（省略時はローカルで websub.py を起動）')
+    parser.add_argument('--secret', help='hub.secret（省略時はランダム生成、ローカル起動時のみ）')
+    parser.add_argument('--video-id', action='append', help=f'通知する動画 ID（既定: {SAMPLE_VIDEO_ID}）')
+    args = parser.parse_args()
+
+    if args.callback and not args.secret:
+        parser.error('--callback には --secret が必要です')
+    secret = args.secret or secrets.token_hex(16)
+    os.environ['WEBSUB_SECRET'] = secret
+    import websub
+
+    callback = args.callback or serve_locally(websub)
+    video_ids = args.video_id or [SAMPLE_VIDEO_ID]
+    print(f'Callback: {callback}')
+    ok = True
+
+    # 1. Verification of intent
+    challenge = secrets.token_hex(8)
+    query = urllib.parse.urlencode({
+        'hub.mode': 'subscribe',
+        'hub.topic': websub.TOPIC_URL,
+        'hub.challenge': challenge,
+        'hub.lease_seconds': websub.LEASE_SECONDS,
+    })
+    status, body = request(f'{callback}?{query}')
+    ok &= check(f'verify subscribe → {status}', status == 200 and body == challenge)
+
+    query = urllib.parse.urlencode({'hub.mode': 'subscribe', 'hub.topic': 'https://example.com/', 'hub.challenge': challenge})
+    status, body = request(f'{callback}?{query}')
+    ok &= check(f'verify other topic → {status}', status == 404)
+
+    # 2. Signed notification
+    feed = sample_feed(websub, video_ids)
+    signature = 'sha1=' + hmac.new(secret.encode(), feed, hashlib.sha1).hexdigest()
+    headers = {'Content-Type': 'application/atom+xml', 'X-Hub-Signature': signature}
+    status, _ = request(callback, feed, headers)
+    ok &= check(f'signed notification ({", ".join(video_ids)}) → {status}', 200 <= status < 300)
+
+    # 3. Bad signature (must still be 2xx, and nothing enqueued)
+    headers['X-Hub-Signature'] = 'sha1=' + '0' * 40
+    status, _ = request(callback, feed, headers)
+    ok &= check(f'bad signature → {status}', 200 <= status < 300)
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
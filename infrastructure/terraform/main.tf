@@ -19,4 +19,5 @@ module "data_pipeline" {
   s3_bucket_arn      = module.data_storage.bucket_arn
   youtube_secret_arn     = module.secrets.youtube_api_secret_arn
   deploy_hook_secret_arn = module.secrets.deploy_hook_secret_arn
+  websub_secret_arn      = module.secrets.websub_secret_arn
 }
@@ -10,12 +10,18 @@ resource "aws_lambda_function" "data_updater" {
   filename         = var.lambda_zip_path
   source_code_hash = filebase64sha256(var.lambda_zip_path)
 
+  # S3 の差分列（manifest + deltas）を同時に書き換えないよう直列化
+  reserved_concurrent_executions = 1
+
   environment {
     variables = {
       S3_BUCKET          = var.s3_bucket_name
       S3_DB_KEY          = "danin-log.db"
       YOUTUBE_SECRET_ARN = var.youtube_secret_arn
       DEPLOY_HOOK_SECRET_ARN = var.deploy_hook_secret_arn
+      COMPACT_EVERY      = "24"
+      DEPLOY_QUIET_SECONDS     = "1800"
+      DEPLOY_MAX_DELAY_SECONDS = "7200"
     }
   }
 }
@@ -51,9 +57,18 @@ resource "aws_iam_role_policy" "lambda_policy" {
         Action = [
           "s3:GetObject",
           "s3:PutObject",
+          "s3:DeleteObject",
         ]
         Resource = "${var.s3_bucket_arn}/*"
       },
+      {
+        # manifest 未作成時に AccessDenied ではなく NoSuchKey を返させるため
+        Effect = "Allow"
+        Action = [
+          "s3:ListBucket",
+        ]
+        Resource = var.s3_bucket_arn
+      },
       {
         Effect = "Allow"
         Action = [
@@ -64,6 +79,118 @@ resource "aws_iam_role_policy" "lambda_policy" {
           var.deploy_hook_secret_arn,
         ]
       },
+      {
+        Effect = "Allow"
+        Action = [
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:GetQueueAttributes",
+        ]
+        Resource = aws_sqs_queue.websub.arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "logs:CreateLogGroup",
+          "logs:CreateLogStream",
+          "logs:PutLogEvents",
+        ]
+        Resource = "arn:aws:logs:*:*:*"
+      }
+    ]
+  })
+}
+
+# ---------- WebSub receiver ----------
+
+# 通知された動画 ID のキュー。data updater がバッチでまとめて受け取る
+# （reserved concurrency 1 のため定期 tick と重なるとスロットリングされ、受信回数が増える）
+resource "aws_sqs_queue" "websub" {
+  name                       = "${var.project_name}-websub"
+  visibility_timeout_seconds = 6 * aws_lambda_function.data_updater.timeout
+  message_retention_seconds  = 4 * 86400
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.websub_dlq.arn
+    maxReceiveCount     = 10
+  })
+}
+
+# 処理できなかった通知（取りこぼしは定期ポーリングでも拾われる。必要ならコンソールから redrive）
+resource "aws_sqs_queue" "websub_dlq" {
+  name                      = "${var.project_name}-websub-dlq"
+  message_retention_seconds = 14 * 86400
+}
+
+resource "aws_lambda_event_source_mapping" "websub" {
+  event_source_arn                   = aws_sqs_queue.websub.arn
+  function_name                      = aws_lambda_function.data_updater.arn
+  batch_size                         = 100
+  maximum_batching_window_in_seconds = 60
+}
+
+resource "aws_lambda_function" "websub" {
+  function_name    = "${var.project_name}-websub"
+  runtime          = "python3.12"
+  handler          = "websub.lambda_handler"
+  timeout          = 10
+  memory_size      = 128
+  role             = aws_iam_role.websub.arn
+  filename         = var.lambda_zip_path
+  source_code_hash = filebase64sha256(var.lambda_zip_path)
+
+  environment {
+    variables = {
+      QUEUE_URL         = aws_sqs_queue.websub.url
+      WEBSUB_SECRET_ARN = var.websub_secret_arn
+    }
+  }
+}
+
+# hub からの購読確認 / 通知を受ける公開エンドポイント（POST は X-Hub-Signature で検証）
+resource "aws_lambda_function_url" "websub" {
+  function_name      = aws_lambda_function.websub.function_name
+  authorization_type = "NONE"
+}
+
+resource "aws_iam_role" "websub" {
+  name = "${var.project_name}-websub-role"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "lambda.amazonaws.com"
+        }
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy" "websub_policy" {
+  name = "websub-policy"
+  role = aws_iam_role.websub.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "sqs:SendMessage",
+        ]
+        Resource = aws_sqs_queue.websub.arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "secretsmanager:GetSecretValue",
+        ]
+        Resource = var.websub_secret_arn
+      },
       {
         Effect = "Allow"
         Action = [
@@ -79,7 +206,8 @@ resource "aws_iam_role_policy" "lambda_policy" {
 
 # ---------- EventBridge Scheduler ----------
 
-resource "aws_scheduler_schedule" "every_15min" {
+# 取りこぼし対策の差分ポーリング（新着は WebSub で届くので毎時）
+resource "aws_scheduler_schedule" "hourly_poll" {
   name       = "${var.project_name}-data-update"
   group_name = "default"
 
@@ -87,7 +215,7 @@ resource "aws_scheduler_schedule" "every_15min" {
     mode = "OFF"
   }
 
-  schedule_expression          = "rate(15 minutes)"
+  schedule_expression          = var.poll_schedule_expression
   schedule_expression_timezone = "Asia/Tokyo"
 
   target {
@@ -96,6 +224,68 @@ resource "aws_scheduler_schedule" "every_15min" {
   }
 }
 
+# 15 分間隔だった頃のリソース名から state を引き継ぐ
+moved {
+  from = aws_scheduler_schedule.every_15min
+  to   = aws_scheduler_schedule.hourly_poll
+}
+
+resource "aws_scheduler_schedule" "daily_full" {
+  name       = "${var.project_name}-data-update-full"
+  group_name = "default"
+
+  flexible_time_window {
+    mode = "OFF"
+  }
+
+  schedule_expression          = "cron(0 4 * * ? *)"
+  schedule_expression_timezone = "Asia/Tokyo"
+
+  target {
+    arn      = aws_lambda_function.data_updater.arn
+    role_arn = aws_iam_role.scheduler.arn
+    input    = jsonencode({ mode = "full" })
+  }
+}
+
+# 保留中のデプロイの期限確認だけを行う短い tick（ポーリングを低頻度にしても反映を遅らせない）
+resource "aws_scheduler_schedule" "deploy_check" {
+  name       = "${var.project_name}-deploy-check"
+  group_name = "default"
+
+  flexible_time_window {
+    mode = "OFF"
+  }
+
+  schedule_expression          = var.deploy_check_schedule_expression
+  schedule_expression_timezone = "Asia/Tokyo"
+
+  target {
+    arn      = aws_lambda_function.data_updater.arn
+    role_arn = aws_iam_role.scheduler.arn
+    input    = jsonencode({ action = "deploy" })
+  }
+}
+
+# lease（5 日）が切れる前に日次で再購読
+resource "aws_scheduler_schedule" "websub_subscribe" {
+  name       = "${var.project_name}-websub-subscribe"
+  group_name = "default"
+
+  flexible_time_window {
+    mode = "OFF"
+  }
+
+  schedule_expression          = "cron(0 5 * * ? *)"
+  schedule_expression_timezone = "Asia/Tokyo"
+
+  target {
+    arn      = aws_lambda_function.websub.arn
+    role_arn = aws_iam_role.scheduler.arn
+    input    = jsonencode({ action = "subscribe", callback = aws_lambda_function_url.websub.function_url })
+  }
+}
+
 resource "aws_iam_role" "scheduler" {
   name = "${var.project_name}-scheduler-role"
 
@@ -123,7 +313,10 @@ resource "aws_iam_role_policy" "scheduler_invoke" {
       {
         Effect   = "Allow"
         Action   = "lambda:InvokeFunction"
-        Resource = aws_lambda_function.data_updater.arn
+        Resource = [
+          aws_lambda_function.data_updater.arn,
+          aws_lambda_function.websub.arn,
+        ]
       }
     ]
   })
@@ -135,3 +328,8 @@ resource "aws_cloudwatch_log_group" "lambda" {
   name              = "/aws/lambda/${aws_lambda_function.data_updater.function_name}"
   retention_in_days = 14
 }
+
+resource "aws_cloudwatch_log_group" "websub" {
+  name              = "/aws/lambda/${aws_lambda_function.websub.function_name}"
+  retention_in_days = 14
+}
@@ -14,6 +14,26 @@ output "log_group_name" {
 }
 
 output "schedule_name" {
-  description = "EventBridge Scheduler schedule name"
-  value       = aws_scheduler_schedule.every_15min.name
+  description = "EventBridge Scheduler schedule name (hourly incremental poll)"
+  value       = aws_scheduler_schedule.hourly_poll.name
+}
+
+output "full_schedule_name" {
+  description = "EventBridge Scheduler schedule name (daily full reconcile)"
+  value       = aws_scheduler_schedule.daily_full.name
+}
+
+output "websub_callback_url" {
+  description = "WebSub callback URL (Lambda Function URL)"
+  value       = aws_lambda_function_url.websub.function_url
+}
+
+output "websub_queue_url" {
+  description = "SQS queue of notified video IDs"
+  value       = aws_sqs_queue.websub.url
+}
+
+output "websub_dlq_url" {
+  description = "SQS dead-letter queue of notifications the updater could not process"
+  value       = aws_sqs_queue.websub_dlq.url
 }
@@ -27,3 +27,20 @@ variable "deploy_hook_secret_arn" {
   description = "ARN of the Vercel Deploy Hook secret"
   type        = string
 }
+
+variable "websub_secret_arn" {
+  description = "ARN of the WebSub HMAC secret"
+  type        = string
+}
+
+variable "poll_schedule_expression" {
+  description = "Schedule for the incremental poll (safety net; new uploads arrive via WebSub)"
+  type        = string
+  default     = "rate(1 hour)"
+}
+
+variable "deploy_check_schedule_expression" {
+  description = "Schedule for the deploy-check tick (fires the coalesced Vercel deploy once it is due)"
+  type        = string
+  default     = "rate(10 minutes)"
+}
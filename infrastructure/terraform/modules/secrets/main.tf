@@ -17,3 +17,13 @@ resource "aws_secretsmanager_secret" "deploy_hook" {
     ignore_changes = [name]
   }
 }
+
+# WebSub hub.secret (X-Hub-Signature の HMAC 鍵。任意のランダム文字列)
+resource "aws_secretsmanager_secret" "websub" {
+  name        = "/${var.project_name}/websub-secret"
+  description = "WebSub (PubSubHubbub) HMAC secret for ${var.project_name}"
+
+  lifecycle {
+    ignore_changes = [name]
+  }
+}
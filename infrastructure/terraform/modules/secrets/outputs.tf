@@ -7,3 +7,8 @@ output "deploy_hook_secret_arn" {
   description = "ARN of the Vercel Deploy Hook secret"
   value       = aws_secretsmanager_secret.deploy_hook.arn
 }
+
+output "websub_secret_arn" {
+  description = "ARN of the WebSub HMAC secret"
+  value       = aws_secretsmanager_secret.websub.arn
+}
@@ -24,3 +24,8 @@ output "lambda_log_group" {
   description = "CloudWatch Logs group for Lambda"
   value       = module.data_pipeline.log_group_name
 }
+
+output "websub_callback_url" {
+  description = "WebSub callback URL (Lambda Function URL)"
+  value       = module.data_pipeline.websub_callback_url
+}
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+セットリストパーサ（SetlistParser）のマイクロベンチマーク + 回帰チェック。
+
+コーパス: data-review/.cache/comments/ のキャッシュ済みコメント（extract_songs.py 実行で蓄積）
+比較対象: 旧実装（コメントごとに正規表現を組み立てる版）
+
+  - 全コメントで新旧の (title, artist, seconds) が一致しなければ失敗
+  - 新実装が --min-speedup 倍より遅ければ失敗
+
+使い方:
+  python3 bench_setlist_parser.py
+  python3 bench_setlist_parser.py --repeat 5 --min-speedup 1.5
+"""
+
+import argparse
+import gzip
+import json
+import re
+import sys
+import time
+
+from extract_songs_common import CACHE_DIR, extract_songs_from_comment, parse_timestamp
+
+
+def legacy_extract_songs_from_comment(text):
+    """旧実装（比較用にそのまま保持）。"""
+    text = re.sub(r'<[^>]+>', '', text)
+
+    ts_pat = r'(\d{1,2}:\d{2}(?::\d{2})?)'
+    matches = re.findall(
+        f'{ts_pat}\\s*(?:\\d+\\.?)?\\s*(.+?)(?=(?:\\d{{1,2}}:\\d{{2}})|$)',
+        text, re.MULTILINE | re.DOTALL,
+    )
+
+    songs = []
+    skip_patterns = [
+        r'^(MC|EN|opening|start|挨拶|お手紙|♫|🎵)',
+        r'(チャンネル登録|カウンター|音量調整)',
+        r'(団長|ドラマ|アレルギー|食べた|語っている|気付く|やりたいこと)',
+        r'^(教師|高校生|結婚できない|占い)',
+        r'「.*」',
+        r'○',
+        r'^\([^)]+\)',
+        r'^(見ていない|に似てる|ですか)',
+        r'の熱帯夜',
+    ]
+
+    for ts_str, song_info in matches:
+        song_info = re.sub(r'\s+', ' ', song_info.strip())
+        if not song_info:
+            continue
+
+        artist_match = re.match(r'(.+?)\s*[/／\-－]\s*(.+)', song_info)
+        if artist_match:
+            title = artist_match.group(1).strip()
+            artist = artist_match.group(2).strip()
+        else:
+            title = song_info
+            artist = ''
+
+        title = re.sub(r'^\d+\.\s*', '', title)
+        title = re.sub(r'^0?\d\s*曲目[:：]\s*', '', title)
+
+        if any(re.search(p, title, re.IGNORECASE) for p in skip_patterns):
+            continue
+
+        seconds = parse_timestamp(ts_str)
+        if title and len(title) > 2:
+            songs.append((title, artist, seconds))
+
+    return songs
+
+
+def load_corpus():
+    texts = []
+    for path in sorted(CACHE_DIR.glob('*.json.gz')):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            entry = json.load(f)
+        for item in entry['response'].get('items', []):
+            texts.append(item['snippet']['topLevelComment']['snippet']['textDisplay'])
+    return texts
+
+
+def bench(fn, texts, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for t in texts:
+            fn(t)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SetlistParser ベンチマーク')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--min-speedup', type=float, default=1.0)
+    args = parser.parse_args()
+
+    texts = load_corpus()
+    if not texts:
+        print(f'エラー: {CACHE_DIR} にキャッシュ済みコメントがありません（先に just songs を実行）')
+        sys.exit(1)
+    print(f'コーパス: {len(texts)}コメント')
+
+    mismatches = [t for t in texts if extract_songs_from_comment(t) != legacy_extract_songs_from_comment(t)]
+    if mismatches:
+        print(f'エラー: 新旧の抽出結果が {len(mismatches)}件で不一致')
+        for t in mismatches[:5]:
+            print(f'  {t[:80]!r}')
+        sys.exit(1)
+
+    legacy = bench(legacy_extract_songs_from_comment, texts, args.repeat)
+    current = bench(extract_songs_from_comment, texts, args.repeat)
+    speedup = legacy / current if current else float('inf')
+
+    print(f'旧実装: {legacy * 1000:.1f}ms, 新実装: {current * 1000:.1f}ms, {speedup:.2f}倍')
+    if speedup < args.min_speedup:
+        print(f'エラー: 速度が基準（{args.min_speedup}倍）を下回りました')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
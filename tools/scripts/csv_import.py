@@ -0,0 +1,47 @@
+"""
+レビュー済み中間CSVのストリーミング取り込み（songs / music_videos / tags importer 共通）。
+
+  - read_review_csv: CSV を 1 行ずつ返すジェネレータ（全件をメモリに載せない）
+  - import_batches:  行を BATCH_SIZE 件ずつ 1 トランザクションで書き込み、進捗とスループットを表示
+"""
+
+import csv
+import time
+from collections import Counter
+from itertools import islice
+
+BATCH_SIZE = 1000
+
+
+def read_review_csv(path):
+    """DictReader の行を順に返す。ファイルがなければ FileNotFoundError（存在確認は呼び出し側の main で行う）"""
+    with open(path, newline='', encoding='utf-8') as f:
+        yield from csv.DictReader(f)
+
+
+def batched(rows, size):
+    it = iter(rows)
+    while batch := list(islice(it, size)):
+        yield batch
+
+
+def import_batches(conn, rows, write_batch, batch_size=BATCH_SIZE) -> Counter:
+    """rows を batch_size 件ずつ write_batch(conn, batch) で書き込む。
+
+    1 バッチ = 1 トランザクション（失敗したバッチはロールバック、それ以前は確定済み）。
+    write_batch が返す件数 dict を合算し、書き込んだ行数を 'rows' に入れて返す。
+    """
+    totals = Counter()
+    start = time.perf_counter()
+    for batch in batched(rows, batch_size):
+        conn.execute('BEGIN')
+        try:
+            totals.update(write_batch(conn, batch) or {})
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        totals['rows'] += len(batch)
+        elapsed = time.perf_counter() - start
+        print(f'  {totals["rows"]}件 書き込み済み（{totals["rows"] / elapsed:.0f}件/秒）')
+    return totals
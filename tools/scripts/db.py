@@ -1,5 +1,6 @@
-"""共有 SQLite 接続ヘルパー"""
+"""共有 SQLite 接続・一括書き込みヘルパー"""
 
+import atexit
 import sqlite3
 from pathlib import Path
 
@@ -7,17 +8,125 @@ ROOT = Path(__file__).resolve().parent.parent  # tools/
 REPO_ROOT = ROOT.parent
 DB_PATH = REPO_ROOT / 'web' / 'data' / 'danin-log.db'
 
+# 全接続共通の PRAGMA（ページキャッシュ 64MB、mmap 256MB、一時テーブルはメモリ）
+COMMON_PRAGMAS = {
+    'cache_size': -64 * 1024,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
 
-def get_connection(readonly=False) -> sqlite3.Connection:
-    """FK 有効・Row factory 付きの接続を返す"""
-    uri = f'file:{DB_PATH}'
+# ワークロード別の PRAGMA（読み取り専用接続には適用しない）
+#   default: ローカルのマスタ DB。S3 に上げて Vercel が読み取り専用で開くので WAL にはしない
+#            （読み取り専用 FS では -shm を作れず WAL の DB を開けない）。以前 WAL にしたファイルも戻す
+#   bulk:    使い捨てコピーへの一括書き込み（Lambda の /tmp 等）。fsync しない。
+#            journal_mode はファイルの既存モードを維持する（WAL ヘッダを書き換えない）
+WORKLOAD_PRAGMAS = {
+    'default': {'journal_mode': 'DELETE'},
+    'bulk': {'synchronous': 'OFF'},
+}
+
+_shared: dict = {}
+
+
+def get_connection(readonly=False, workload='default', db_path=None) -> sqlite3.Connection:
+    """FK 有効・Row factory 付き・PRAGMA 調整済みの接続を返す"""
+    uri = f'file:{db_path or DB_PATH}'
     if readonly:
         uri += '?mode=ro'
     conn = sqlite3.connect(uri, uri=True)
     conn.row_factory = sqlite3.Row
     conn.execute('PRAGMA foreign_keys = ON')
+
+    pragmas = dict(COMMON_PRAGMAS)
+    if not readonly:
+        pragmas.update(WORKLOAD_PRAGMAS[workload])
+    for name, value in pragmas.items():
+        conn.execute(f'PRAGMA {name} = {value}')
     return conn
 
 
 def get_readonly_connection() -> sqlite3.Connection:
     return get_connection(readonly=True)
+
+
+def get_shared_connection(readonly=False) -> sqlite3.Connection:
+    """プロセス内で使い回す接続（読み取り専用 / 読み書きで 1 本ずつ）。close しないこと。"""
+    conn = _shared.get(readonly)
+    if conn is None:
+        conn = _shared[readonly] = get_connection(readonly=readonly)
+    return conn
+
+
+@atexit.register
+def close_shared_connections():
+    while _shared:
+        _, conn = _shared.popitem()
+        conn.close()
+
+
+# ---------- 一括書き込み ----------
+
+def upsert_rows(conn, table, columns, rows, on_conflict='ignore', key=None) -> dict:
+    """行タプルの iterable を executemany で一括書き込みする。
+
+    on_conflict:
+      'ignore' → INSERT OR IGNORE（重複は無視）
+      'update' → key が既存の行は key 以外の列を更新（値が同じ行は書き込まない）
+
+    件数は conn.total_changes の差分から求める（テーブル全体の COUNT はしない）。
+    update は「key の衝突を無視して INSERT → 値が異なる既存行だけ UPDATE」の 2 段で、
+    それぞれの変更数がそのまま inserted / updated になる。
+
+    戻り値: {'inserted': n, 'updated': n, 'ignored': n}（ignored = 重複 / 値が同じで書き込まなかった行）
+    """
+    rows = list(rows)
+    placeholders = ', '.join('?' for _ in columns)
+    if on_conflict == 'ignore':
+        insert_sql = f'INSERT OR IGNORE INTO {table} ({", ".join(columns)}) VALUES ({placeholders})'
+    elif on_conflict == 'update':
+        keys = [key] if isinstance(key, str) else list(key)
+        insert_sql = (
+            f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({placeholders}) '
+            f'ON CONFLICT({", ".join(keys)}) DO NOTHING'
+        )
+    else:
+        raise ValueError(f'unknown on_conflict: {on_conflict}')
+
+    changes_before = conn.total_changes
+    conn.executemany(insert_sql, rows)
+    inserted = conn.total_changes - changes_before
+
+    updated = 0
+    if on_conflict == 'update':
+        values = [c for c in columns if c not in keys]
+        if values:
+            key_idx = [columns.index(k) for k in keys]
+            value_idx = [columns.index(c) for c in values]
+            update_sql = (
+                f'UPDATE {table} SET {", ".join(f"{c} = ?" for c in values)} '
+                f'WHERE {" AND ".join(f"{k} = ?" for k in keys)} '
+                f'AND ({" OR ".join(f"{c} IS NOT ?" for c in values)})'
+            )
+            changes_before = conn.total_changes
+            conn.executemany(update_sql, (
+                [row[i] for i in value_idx] + [row[i] for i in key_idx] + [row[i] for i in value_idx]
+                for row in rows
+            ))
+            updated = conn.total_changes - changes_before
+
+    return {
+        'inserted': inserted,
+        'updated': updated,
+        'ignored': len(rows) - inserted - updated,
+    }
+
+
+def analyze(conn):
+    """一括書き込み後にクエリプランナの統計（sqlite_stat1）を更新する"""
+    conn.execute('ANALYZE')
+
+
+def optimize(conn):
+    """少量の差分書き込み後の軽量版。統計が古くなったテーブルだけ、走査行数を絞って ANALYZE する"""
+    conn.execute('PRAGMA analysis_limit = 400')
+    conn.execute('PRAGMA optimize')
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+ホットクエリ用のカバリングインデックス作成 + 実行計画チェック。
+
+対象クエリ（SQL は hot_queries.py）:
+  - extract_songs_common.get_tagged_video_ids（タグ → 配信動画）
+  - stream_tag_extractor.load_stream_data（配信動画一覧）
+
+  1. INDEXES を CREATE INDEX IF NOT EXISTS で作成
+  2. ANALYZE で統計を更新
+  3. EXPLAIN QUERY PLAN でフルスキャンに落ちていないか検証（落ちていれば失敗）
+
+NOT IN (SELECT video_id FROM hidden_streams) のリスト化は 1 回きりの走査なので許容する。
+
+使い方:
+  python3 db_indexes.py           # 作成 + ANALYZE + チェック
+  python3 db_indexes.py --check   # チェックのみ（読み取り専用）
+"""
+
+import argparse
+import sys
+
+from db import analyze, get_connection
+from hot_queries import STREAM_DATA_SQL, TAGGED_VIDEOS_SQL
+
+# (インデックス名, テーブル, 列)
+INDEXES = [
+    ('idx_video_stream_tags_tag_video', 'video_stream_tags', ['tag_id', 'video_id']),
+    ('idx_video_video_types_type_video', 'video_video_types', ['video_type_id', 'video_id']),
+    ('idx_stream_tags_name', 'stream_tags', ['name', 'id']),
+    ('idx_video_types_type', 'video_types', ['type', 'id']),
+]
+
+# (名前, SQL, パラメータ)
+HOT_QUERIES = [
+    ('get_tagged_video_ids', TAGGED_VIDEOS_SQL, ('歌枠',)),
+    ('load_stream_data', STREAM_DATA_SQL, ()),
+]
+
+
+def create_indexes(conn):
+    for name, table, columns in INDEXES:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)})')
+
+
+def full_scans(conn, sql, params):
+    """実行計画のうちフルスキャンの行（LIST SUBQUERY 配下を除く）を返す"""
+    plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+    allowed = set()
+    scans = []
+    for node_id, parent, _, detail in plan:
+        if parent in allowed or detail.startswith('LIST SUBQUERY'):
+            allowed.add(node_id)
+        elif detail.startswith('SCAN '):
+            scans.append(detail)
+    return scans
+
+
+def check_query_plans(conn) -> bool:
+    ok = True
+    for name, sql, params in HOT_QUERIES:
+        scans = full_scans(conn, sql, params)
+        if scans:
+            ok = False
+            print(f'NG {name}')
+            for detail in scans:
+                print(f'  {detail}')
+        else:
+            print(f'OK {name}')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='カバリングインデックス作成 + 実行計画チェック')
+    parser.add_argument('--check', action='store_true', help='作成せずチェックのみ')
+    args = parser.parse_args()
+
+    conn = get_connection(readonly=args.check)
+    if not args.check:
+        create_indexes(conn)
+        analyze(conn)
+        conn.commit()
+        print(f'インデックス: {len(INDEXES)}件作成済み, ANALYZE 完了')
+
+    ok = check_query_plans(conn)
+    conn.close()
+    if not ok:
+        print('エラー: フルスキャンに落ちているクエリがあります')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
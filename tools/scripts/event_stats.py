@@ -6,54 +6,240 @@ Usage:
     python event_stats.py top-streams    # チェック数 Top 20 配信
     python event_stats.py top-songs      # お気に入り数 Top 20 楽曲
     python event_stats.py shares         # シェア・DL 回数（ページ別）
+
+Options:
+    --since YYYY-MM-DD   この日以降（UTC）のイベントのみ
+    --until YYYY-MM-DD   この日まで（UTC、当日を含む）のイベントのみ
+    --segments N         全件集計時の並列 Scan セグメント数（既定 4、--no-rollup 時）
+    --no-rollup          ロールアップを使わず DynamoDB から直接集計する
+
+既定では日別ロールアップ（data-review/.cache/event_rollup_{local,prod}.db）から集計する。
+実行ごとに pk ごとの最終 sk（ハイウォーターマーク）より新しいイベントだけを Query して
+ロールアップにマージするため、コストは新着イベント数に比例する。
+
+--no-rollup の場合、各サブコマンドは必要な pk だけを Query し、ページ単位で集計する。
+期間指定なしの summary / daily は全件が必要なため、セグメント並列 Scan で集計する。
+どちらも取得したページはその場で集計して捨てる（全件をメモリに載せない）。
 """
 
+import argparse
 import os
+import queue
+import sqlite3
 import sys
+import threading
 from collections import Counter, defaultdict
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
 
 import boto3
+from boto3.dynamodb.conditions import Key
 
 TABLE_NAME = "danin-log-events"
 REGION = "ap-northeast-1"
 ENDPOINT_URL = os.environ.get("AWS_ENDPOINT_URL")
 
-
-def scan_all(table):
-    """DynamoDB テーブルの全件を取得"""
-    items = []
-    response = table.scan()
-    items.extend(response["Items"])
-    while "LastEvaluatedKey" in response:
-        response = table.scan(ExclusiveStartKey=response["LastEvaluatedKey"])
-        items.extend(response["Items"])
-    return items
-
+# pk（イベント種別）。web/src/app/api/events/route.ts の ALLOWED_TYPES と一致させる
+EVENT_TYPES = ["stream_check", "song_favorite", "share", "download"]
+
+# 集計に使う属性のみ取得（action は予約語のため属性名プレースホルダを使う）
+PROJECTED_ATTRS = ["pk", "sk", "action", "target_id", "page", "created_at"]
+PROJECTION = {
+    "ProjectionExpression": ", ".join(f"#{a}" for a in PROJECTED_ATTRS),
+    "ExpressionAttributeNames": {f"#{a}": a for a in PROJECTED_ATTRS},
+}
+
+SCAN_SEGMENTS = 4
+
+ROLLUP_DIR = Path(__file__).resolve().parent.parent / "data-review" / ".cache"
+# 書き込み中のイベントを取りこぼさないよう、直近この時間内のイベントは次回に回す
+ROLLUP_LAG = timedelta(minutes=1)
+
+
+def sk_condition(pk, since=None, until=None):
+    """pk 一致 + sk（ISO 日時#uuid）の日付範囲の KeyConditionExpression"""
+    cond = Key("pk").eq(pk)
+    upper = None
+    if until:
+        upper = (datetime.strptime(until, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+    if since and upper:
+        return cond & Key("sk").between(since, upper)
+    if since:
+        return cond & Key("sk").gte(since)
+    if upper:
+        return cond & Key("sk").lt(upper)
+    return cond
+
+
+def query_pages(table, key_condition):
+    """Query 結果をページ単位で取得して 1 件ずつ yield する"""
+    kwargs = {"KeyConditionExpression": key_condition, **PROJECTION}
+    while True:
+        response = table.query(**kwargs)
+        yield from response["Items"]
+        if "LastEvaluatedKey" not in response:
+            break
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def query_events(table, pks, since=None, until=None):
+    """指定 pk のイベントを Query でページ単位に yield する（全件をメモリに載せない）"""
+    for pk in pks:
+        yield from query_pages(table, sk_condition(pk, since, until))
+
+
+def parallel_scan(make_table, segments=SCAN_SEGMENTS):
+    """Segment/TotalSegments による並列 Scan。ページを到着順に yield する。
+
+    boto3 の resource はスレッドセーフでないため、セグメントごとに make_table() で作る。
+    キューは有限長なので、集計側が遅ければ Scan 側が待つ（メモリは一定）。
+    """
+    pages = queue.Queue(maxsize=segments * 2)
+    stop = threading.Event()
+
+    def worker(segment):
+        table = make_table()
+        kwargs = {"Segment": segment, "TotalSegments": segments, **PROJECTION}
+        try:
+            while not stop.is_set():
+                response = table.scan(**kwargs)
+                pages.put(response["Items"])
+                if "LastEvaluatedKey" not in response:
+                    break
+                kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        finally:
+            pages.put(None)
+
+    with ThreadPoolExecutor(max_workers=segments) as pool:
+        futures = [pool.submit(worker, seg) for seg in range(segments)]
+        finished = 0
+        try:
+            while finished < segments:
+                page = pages.get()
+                if page is None:
+                    finished += 1
+                    continue
+                yield from page
+        finally:
+            # 集計側が途中で抜けた場合もワーカーを止めてキューを空ける
+            stop.set()
+            while finished < segments:
+                if pages.get() is None:
+                    finished += 1
+        for f in futures:
+            f.result()  # Scan 中の例外を再送出
+
+
+# ---------- ロールアップ ----------
+
+def open_rollup():
+    """日別 × pk × action × target_id × page の件数と、pk ごとの最終 sk を持つ SQLite"""
+    ROLLUP_DIR.mkdir(parents=True, exist_ok=True)
+    path = ROLLUP_DIR / f"event_rollup_{'local' if ENDPOINT_URL else 'prod'}.db"
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS rollup (
+            day TEXT NOT NULL,
+            pk TEXT NOT NULL,
+            action TEXT NOT NULL,
+            target_id TEXT NOT NULL,
+            page TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (day, pk, action, target_id, page)
+        );
+        CREATE TABLE IF NOT EXISTS watermark (
+            pk TEXT PRIMARY KEY,
+            sk TEXT NOT NULL
+        );
+    """)
+    return conn
+
+
+def refresh_rollup(conn, table):
+    """ハイウォーターマーク以降のイベントだけを Query してロールアップにマージ。新着件数を返す"""
+    upper = (datetime.now(timezone.utc) - ROLLUP_LAG).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+    total = 0
+    for pk in EVENT_TYPES:
+        row = conn.execute("SELECT sk FROM watermark WHERE pk = ?", (pk,)).fetchone()
+        mark = row[0] if row else None
+        if mark:
+            cond = Key("pk").eq(pk) & Key("sk").between(mark, upper)
+        else:
+            cond = Key("pk").eq(pk) & Key("sk").lt(upper)
+
+        counts = Counter()
+        last = mark
+        for item in query_pages(table, cond):
+            if item["sk"] == mark:
+                continue  # between は境界を含むため
+            day = item.get("created_at", item["sk"])[:10]
+            counts[(day, pk, item["action"], item.get("target_id", ""), item.get("page", ""))] += 1
+            last = max(last or "", item["sk"])
+
+        with conn:
+            conn.executemany(
+                """INSERT INTO rollup (day, pk, action, target_id, page, count) VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(day, pk, action, target_id, page) DO UPDATE SET
+                     count = count + excluded.count""",
+                [(*key, n) for key, n in counts.items()],
+            )
+            if last:
+                conn.execute(
+                    """INSERT INTO watermark (pk, sk) VALUES (?, ?)
+                       ON CONFLICT(pk) DO UPDATE SET sk = excluded.sk""",
+                    (pk, last),
+                )
+        total += sum(counts.values())
+    return total
+
+
+def rollup_events(conn, pks, since=None, until=None):
+    """ロールアップ行をイベント相当の dict（count 付き）として yield する"""
+    sql = f"""SELECT day, pk, action, target_id, page, count FROM rollup
+              WHERE pk IN ({", ".join("?" for _ in pks)})"""
+    params = list(pks)
+    if since:
+        sql += " AND day >= ?"
+        params.append(since)
+    if until:
+        sql += " AND day <= ?"
+        params.append(until)
+    for day, pk, action, target_id, page, count in conn.execute(sql, params):
+        yield {"pk": pk, "sk": day, "created_at": day, "action": action,
+               "target_id": target_id, "page": page, "count": count}
+
+
+# ---------- 集計 ----------
+# items は生イベント、またはロールアップ行（count 付き）の iterable
 
 def cmd_summary(items):
     counter = Counter()
+    total = 0
     for item in items:
         key = (item["pk"], item["action"])
-        counter[key] += 1
+        n = item.get("count", 1)
+        counter[key] += n
+        total += n
 
     print(f"{'TYPE':<16} {'ACTION':<10} {'COUNT':>6}")
     print(f"{'----':<16} {'------':<10} {'-----':>6}")
     for (typ, action), count in sorted(counter.items()):
         print(f"{typ:<16} {action:<10} {count:>6}")
-    print(f"\n合計: {len(items)} 件")
+    print(f"\n合計: {total} 件")
 
 
 def cmd_top(items, event_type, id_label):
-    filtered = [i for i in items if i["pk"] == event_type and i.get("target_id")]
     adds = Counter()
     removes = Counter()
-    for item in filtered:
+    for item in items:
+        if item["pk"] != event_type or not item.get("target_id"):
+            continue
         tid = item["target_id"]
         if item["action"] == "add":
-            adds[tid] += 1
+            adds[tid] += item.get("count", 1)
         elif item["action"] == "remove":
-            removes[tid] += 1
+            removes[tid] += item.get("count", 1)
 
     print(f"{id_label:<16} {'ADD':>6} {'REMOVE':>8} {'NET':>6}")
     print(f"{'-' * 16} {'---':>6} {'------':>8} {'---':>6}")
@@ -68,7 +254,7 @@ def cmd_daily(items):
     for item in items:
         date = item.get("created_at", item["sk"])[:10]  # YYYY-MM-DD
         event_key = f"{item['pk']}:{item['action']}"
-        daily[date][event_key] += 1
+        daily[date][event_key] += item.get("count", 1)
 
     if not daily:
         print("イベントがありません")
@@ -131,7 +317,7 @@ def cmd_shares(items):
     for item in items:
         if item["pk"] in ("share", "download"):
             key = (item["pk"], item.get("page", ""))
-            counter[key] += 1
+            counter[key] += item.get("count", 1)
 
     print(f"{'TYPE':<12} {'PAGE':<12} {'COUNT':>6}")
     print(f"{'----':<12} {'----':<12} {'-----':>6}")
@@ -144,24 +330,53 @@ def main():
         print(__doc__)
         sys.exit(1)
 
+    parser = argparse.ArgumentParser(usage=__doc__)
+    parser.add_argument("cmd")
+    parser.add_argument("--since")
+    parser.add_argument("--until")
+    parser.add_argument("--segments", type=int, default=SCAN_SEGMENTS)
+    parser.add_argument("--no-rollup", action="store_true")
+    args = parser.parse_args()
+
     kwargs = {"region_name": REGION}
     if ENDPOINT_URL:
         kwargs["endpoint_url"] = ENDPOINT_URL
-    dynamodb = boto3.resource("dynamodb", **kwargs)
-    table = dynamodb.Table(TABLE_NAME)
-    items = scan_all(table)
 
-    cmd = sys.argv[1]
+    def make_table():
+        return boto3.session.Session().resource("dynamodb", **kwargs).Table(TABLE_NAME)
+
+    table = make_table()
+
+    if args.no_rollup:
+        def events(pks):
+            return query_events(table, pks, args.since, args.until)
+
+        def all_events():
+            if args.since or args.until:
+                return events(EVENT_TYPES)
+            return parallel_scan(make_table, args.segments)
+    else:
+        rollup = open_rollup()
+        added = refresh_rollup(rollup, table)
+        print(f"ロールアップ更新: 新着 {added} 件\n")
+
+        def events(pks):
+            return rollup_events(rollup, pks, args.since, args.until)
+
+        def all_events():
+            return events(EVENT_TYPES)
+
+    cmd = args.cmd
     if cmd == "summary":
-        cmd_summary(items)
+        cmd_summary(all_events())
     elif cmd == "daily":
-        cmd_daily(items)
+        cmd_daily(all_events())
     elif cmd == "top-streams":
-        cmd_top(items, "stream_check", "VIDEO_ID")
+        cmd_top(events(["stream_check"]), "stream_check", "VIDEO_ID")
     elif cmd == "top-songs":
-        cmd_top(items, "song_favorite", "SONG_ID")
+        cmd_top(events(["song_favorite"]), "song_favorite", "SONG_ID")
     elif cmd == "shares":
-        cmd_shares(items)
+        cmd_shares(events(["share", "download"]))
     else:
         print(f"Unknown command: {cmd}")
         print(__doc__)
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Web ビルド用の読み取り最適化スナップショット書き出し（danin-log.db → --out のディレクトリ）。
+
+web の data 層が毎ビルド組み立てている結合（配信 × 種別 × タグ × stream_details、
+曲ごとの歌唱履歴、hidden_streams の除外）をここで 1 回だけ行い、ビュー単位のシャードに分ける:
+
+  streams/page-NNN  配信一覧（web の Stream 型と同じ形、ページ内は startedAt 降順）
+  songs/<song_id>   曲ごとの歌唱タイムライン（歌枠・ライブとも日付昇順）+ MV・収録アルバム
+  tags/<tag_id>     タグごとの配信 ID 一覧（startedAt 降順）+ 件数
+  manifest.json     論理名 → シャードのファイル名（これだけ固定名）
+
+シャードは <論理名>.<内容ハッシュ>.json.gz。内容が同じならファイル名も同じなので既存ファイルは
+書き直さない（ビルドキャッシュ / CDN キャッシュがそのまま効く）。manifest から外れたシャードは削除。
+配信ページは古い順に PAGE_SIZE 件ずつ区切るので、新着で変わるのは最新ページだけになる。
+gzip は mtime=0 で書き、同じ内容なら同じバイト列にする。
+
+web の data 層（streams.ts / music.ts）はまだ SQLite を直接読んでおり、このスナップショットは
+ビルドに組み込んでいない。web/data/ は fetch-data.mjs の置き場なので出力先は明示的に指定する。
+削除対象は streams/ songs/ tags/ 配下のシャードだけ（出力先の他のファイルには触らない）。
+
+使い方:
+  python3 export_snapshot.py --out /path/to/snapshot
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from db import get_readonly_connection
+
+MANIFEST_NAME = 'manifest.json'
+SHARD_DIRS = ('streams', 'songs', 'tags')
+FORMAT_VERSION = 1
+PAGE_SIZE = 100
+HASH_LENGTH = 12
+
+NOEL_CHANNEL_ID = 'UCdyqAaZDKHXg4Ahi7VENThQ'
+
+# web/src/lib/data/streams.ts getStreams と同じ条件（古い順: ページを後ろから埋めるため）
+STREAMS_SQL = """
+    SELECT v.id, v.title, v.thumbnail_url, v.duration,
+           c.id AS channel_id, c.title AS channel_title,
+           c.handle AS channel_handle, c.icon_url AS channel_icon_url,
+           v.published_at,
+           COALESCE(sd.started_at, v.published_at) AS started_at
+    FROM videos v
+    JOIN video_video_types vvt ON v.id = vvt.video_id
+    JOIN video_types vt ON vvt.video_type_id = vt.id
+    JOIN channels c ON v.channel_id = c.id
+    LEFT JOIN stream_details sd ON v.id = sd.video_id
+    WHERE vt.type = 'stream'
+      AND v.channel_id = ?
+      AND v.id NOT IN (SELECT video_id FROM hidden_streams)
+    ORDER BY started_at, v.id
+"""
+
+STREAM_TAGS_SQL = """
+    SELECT vst.video_id, st.id, st.name
+    FROM video_stream_tags vst
+    JOIN stream_tags st ON vst.tag_id = st.id
+    ORDER BY st.id
+"""
+
+# 歌枠 / ライブの歌唱（{table} = stream_songs / concert_songs）
+PERFORMANCES_SQL = """
+    SELECT t.song_id, t.video_id, v.title AS video_title, t.start_seconds,
+           COALESCE(sd.started_at, v.published_at) AS date
+    FROM {table} t
+    JOIN videos v ON t.video_id = v.id
+    LEFT JOIN stream_details sd ON t.video_id = sd.video_id
+    ORDER BY date, t.start_seconds
+"""
+
+MUSIC_VIDEOS_SQL = """
+    SELECT mv.song_id, mv.video_id, v.title AS video_title, mvt.type_name AS type
+    FROM music_videos mv
+    JOIN videos v ON mv.video_id = v.id
+    JOIN music_video_types mvt ON mv.music_video_type_id = mvt.id
+    ORDER BY v.published_at
+"""
+
+ALBUM_TRACKS_SQL = """
+    SELECT at.song_id, at.album_id, a.title AS album_title, at.track_number
+    FROM album_tracks at
+    JOIN albums a ON at.album_id = a.id
+    ORDER BY a.release_date, at.track_number
+"""
+
+
+def encode(obj) -> bytes:
+    """キー順固定の compact JSON（内容ハッシュの入力）"""
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode()
+
+
+class SnapshotWriter:
+    """内容ハッシュ名でシャードを書き出す。既存の同名ファイルは書き直さない"""
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.files = set()
+        self.stats = Counter()
+
+    def write(self, name, obj) -> str:
+        data = encode(obj)
+        filename = f'{name}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}.json.gz'
+        path = self.out_dir / filename
+        if path.exists():
+            self.stats['unchanged'] += 1
+        else:
+            body = gzip.compress(data, compresslevel=9, mtime=0)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + '.tmp')
+            tmp.write_bytes(body)
+            tmp.replace(path)
+            self.stats['written'] += 1
+            self.stats['written_bytes'] += len(body)
+        self.files.add(filename)
+        return filename
+
+    def write_manifest(self, manifest):
+        path = self.out_dir / MANIFEST_NAME
+        data = json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode()
+        if path.exists() and path.read_bytes() == data:
+            return False
+        path.write_bytes(data)
+        return True
+
+    def prune(self):
+        """manifest に載っていない古いシャードを削除（SHARD_DIRS 配下のみ）"""
+        for path in (p for d in SHARD_DIRS for p in (self.out_dir / d).glob('*.json.gz')):
+            if path.relative_to(self.out_dir).as_posix() not in self.files:
+                path.unlink()
+                self.stats['removed'] += 1
+
+
+# ---------- ビュー ----------
+
+def build_streams(conn):
+    """(配信リスト 古い順, {tag_id: {name, videoIds}})"""
+    tags_by_video = defaultdict(list)
+    for r in conn.execute(STREAM_TAGS_SQL):
+        tags_by_video[r['video_id']].append({'id': r['id'], 'name': r['name']})
+    tag_names = {r['id']: r['name'] for r in conn.execute('SELECT id, name FROM stream_tags')}
+
+    streams = []
+    tag_videos = defaultdict(list)
+    for r in conn.execute(STREAMS_SQL, (NOEL_CHANNEL_ID,)):
+        tags = tags_by_video.get(r['id'], [])
+        streams.append({
+            'id': r['id'],
+            'title': r['title'],
+            'thumbnailUrl': r['thumbnail_url'],
+            'duration': r['duration'],
+            'channel': {
+                'id': r['channel_id'],
+                'title': r['channel_title'],
+                'handle': r['channel_handle'],
+                'iconUrl': r['channel_icon_url'],
+            },
+            'publishedAt': r['published_at'],
+            'startedAt': r['started_at'],
+            'tags': tags,
+        })
+        for t in tags:
+            tag_videos[t['id']].append(r['id'])
+
+    tags = {
+        tag_id: {'id': tag_id, 'name': name, 'count': len(tag_videos[tag_id]),
+                 'videoIds': tag_videos[tag_id][::-1]}
+        for tag_id, name in tag_names.items()
+    }
+    return streams, tags
+
+
+def build_songs(conn):
+    """[Song]（performances は日付昇順のタイムライン）"""
+    def group(sql, make):
+        grouped = defaultdict(list)
+        for r in conn.execute(sql):
+            grouped[r['song_id']].append(make(r))
+        return grouped
+
+    def performance(r):
+        return {'videoId': r['video_id'], 'videoTitle': r['video_title'],
+                'startSeconds': r['start_seconds'], 'date': r['date']}
+
+    stream_perfs = group(PERFORMANCES_SQL.format(table='stream_songs'), performance)
+    concert_perfs = group(PERFORMANCES_SQL.format(table='concert_songs'), performance)
+    mvs = group(MUSIC_VIDEOS_SQL, lambda r: {
+        'videoId': r['video_id'], 'videoTitle': r['video_title'], 'type': r['type']})
+    albums = group(ALBUM_TRACKS_SQL, lambda r: {
+        'albumId': r['album_id'], 'albumTitle': r['album_title'], 'trackNumber': r['track_number']})
+
+    return [{
+        'id': s['id'],
+        'title': s['title'],
+        'artist': s['artist'],
+        'streamPerformances': stream_perfs.get(s['id'], []),
+        'concertPerformances': concert_perfs.get(s['id'], []),
+        'musicVideos': mvs.get(s['id'], []),
+        'albums': albums.get(s['id'], []),
+    } for s in conn.execute('SELECT id, title, artist FROM songs ORDER BY id')]
+
+
+def export(conn, out_dir):
+    writer = SnapshotWriter(out_dir)
+    streams, tags = build_streams(conn)
+    songs = build_songs(conn)
+
+    # 古い順に区切り、ページ内・ページ順とも新しい順で manifest に載せる
+    pages = []
+    for i in range(0, len(streams), PAGE_SIZE):
+        page = streams[i:i + PAGE_SIZE][::-1]
+        pages.append(writer.write(f'streams/page-{i // PAGE_SIZE + 1:03d}', page))
+
+    manifest = {
+        'version': FORMAT_VERSION,
+        'streams': {'count': len(streams), 'pageSize': PAGE_SIZE, 'pages': pages[::-1]},
+        'songs': {s['id']: writer.write(f'songs/{s["id"]}', s) for s in songs},
+        'tags': {
+            str(tag_id): {'name': t['name'], 'count': t['count'], 'file': writer.write(f'tags/{tag_id}', t)}
+            for tag_id, t in sorted(tags.items())
+        },
+    }
+    manifest_changed = writer.write_manifest(manifest)
+    writer.prune()
+    return writer.stats, manifest_changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Web ビルド用スナップショット書き出し')
+    parser.add_argument('--out', required=True, help='出力先ディレクトリ')
+    args = parser.parse_args()
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    conn = get_readonly_connection()
+    stats, manifest_changed = export(conn, out_dir)
+    conn.close()
+
+    print(f'出力先: {out_dir}')
+    print(f'  書き込み: {stats["written"]}件（{stats["written_bytes"] / 1024:.1f} KB）')
+    print(f'  変更なし: {stats["unchanged"]}件')
+    print(f'  削除:     {stats["removed"]}件')
+    print(f'  manifest: {"更新" if manifest_changed else "変更なし"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -10,12 +10,28 @@ YouTube コメントから楽曲セットリストを抽出する。
   python3 extract_songs.py                # 歌枠+ライブ両方
   python3 extract_songs.py --type stream  # 歌枠のみ
   python3 extract_songs.py --type live    # ライブのみ
+  python3 extract_songs.py --offline      # API を使わずキャッシュ済みコメントのみで再抽出
+  python3 extract_songs.py --force        # 抽出状態を無視して未インポートの全動画を処理
+
+抽出状態（data-review/.cache/extract_state.db）:
+  動画ごとに最終処理日時・コメント数・結果・PARSER_VERSION（抽出ロジックのハッシュ）を記録し、
+  前回セットリスト未検出でコメント数も増えていない動画は再取得しない。
+  コメント数が増えた動画はコメントキャッシュを TTL 内でも再検証する。
+  --offline では抽出状態を参照・更新しない（抽出ルール調整用に全件再抽出）。
 """
 
 import argparse
 import sys
 
-from extract_songs_common import get_youtube_service, get_tagged_video_ids, process_videos
+from extract_songs_common import (
+    fetch_comment_counts,
+    get_tagged_video_ids,
+    get_youtube_service,
+    open_extract_state,
+    process_videos,
+    record_extract_state,
+    select_pending_videos,
+)
 
 
 TARGETS = {
@@ -31,24 +47,42 @@ TARGETS = {
 def main():
     parser = argparse.ArgumentParser(description='YouTube コメントから楽曲抽出')
     parser.add_argument('--type', choices=['stream', 'live', 'all'], default='all')
+    parser.add_argument('--offline', action='store_true', help='キャッシュ済みコメントのみ使用（API 不使用）')
+    parser.add_argument('--force', action='store_true', help='抽出状態を無視して全件処理')
     args = parser.parse_args()
 
-    try:
-        youtube = get_youtube_service()
-    except ValueError as e:
-        print(f'エラー: {e}')
-        sys.exit(1)
+    youtube = None
+    if not args.offline:
+        try:
+            youtube = get_youtube_service()
+        except ValueError as e:
+            print(f'エラー: {e}')
+            sys.exit(1)
+
+    state = None if args.offline else open_extract_state()
 
     for tag_name, filename, junction_table in TARGETS[args.type]:
         print(f'\n=== {tag_name} ===')
         videos = get_tagged_video_ids(tag_name, junction_table)
+
+        comment_counts = {}
+        refresh = set()
+        if state is not None and videos:
+            comment_counts = fetch_comment_counts(youtube, [vid for vid, _ in videos])
+            if not args.force:
+                videos, refresh = select_pending_videos(state, junction_table, videos, comment_counts)
         print(f'{len(videos)}件の動画\n')
 
         if videos:
-            process_videos(youtube, videos, filename)
+            results = process_videos(youtube, videos, filename, offline=args.offline, refresh=refresh)
+            if state is not None:
+                record_extract_state(state, junction_table, results, comment_counts)
         else:
             print('  動画が見つかりませんでした')
 
+    if state is not None:
+        state.close()
+
     print('\n完了')
 
 
@@ -10,19 +10,44 @@ YouTube コメントから楽曲セットリストを抽出する共通モジュ
 """
 
 import csv
+import gzip
+import hashlib
+import inspect
+import json
 import os
 import re
+import sqlite3
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 
-from db import get_readonly_connection
+from db import get_shared_connection
+from hot_queries import TAGGED_VIDEOS_SQL
+from rate_limiter import RateLimiter
+from youtube_api import execute
 
 ROOT = Path(__file__).resolve().parent.parent  # tools/
 REVIEW_DIR = ROOT / 'data-review'
 
+# コメント取得の並列数とレート上限（リクエスト/秒）
+COMMENT_WORKERS = 4
+COMMENT_RATE = 5.0
+
+# commentThreads レスポンスのローカルキャッシュ
+# TTL 内はそのまま使い、TTL 切れは ETag で再検証する
+CACHE_DIR = REVIEW_DIR / '.cache' / 'comments'
+CACHE_TTL = 7 * 24 * 3600
+CACHE_MAX_AGE = 90 * 24 * 3600
+CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# 動画ごとの抽出状態（パイプライン別）。抽出ロジックのソースが変われば再処理する（PARSER_VERSION）
+STATE_PATH = REVIEW_DIR / '.cache' / 'extract_state.db'
+
 
 # ---------- 環境・API ----------
 
@@ -53,7 +78,7 @@ def get_tagged_video_ids(tag_name: str, junction_table: str = '') -> List[Tuple[
 
     junction_table を指定すると、既にそのテーブルに存在する video_id をスキップする。
     """
-    conn = get_readonly_connection()
+    conn = get_shared_connection(readonly=True)
 
     # 抽出済み video_id を取得
     existing_ids: set[str] = set()
@@ -63,16 +88,7 @@ def get_tagged_video_ids(tag_name: str, junction_table: str = '') -> List[Tuple[
         ).fetchall()
         existing_ids = {r['video_id'] for r in existing_rows}
 
-    rows = conn.execute("""
-        SELECT v.id, v.title, v.published_at
-        FROM videos v
-        JOIN video_stream_tags vst ON v.id = vst.video_id
-        JOIN stream_tags st ON vst.tag_id = st.id
-        WHERE st.name = ?
-          AND v.id NOT IN (SELECT video_id FROM hidden_streams)
-        ORDER BY v.published_at DESC
-    """, (tag_name,)).fetchall()
-    conn.close()
+    rows = conn.execute(TAGGED_VIDEOS_SQL, (tag_name,)).fetchall()
 
     all_videos = [(r['id'], r['title']) for r in rows]
     if not existing_ids:
@@ -83,18 +99,99 @@ def get_tagged_video_ids(tag_name: str, junction_table: str = '') -> List[Tuple[
     return new_videos
 
 
+# ---------- コメントキャッシュ ----------
+
+def _cache_path(video_id: str) -> Path:
+    return CACHE_DIR / f'{video_id}.json.gz'
+
+
+def load_cached_response(video_id: str):
+    """キャッシュ → {'fetched_at', 'etag', 'response'} or None"""
+    path = _cache_path(video_id)
+    if not path.exists():
+        return None
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_cached_response(video_id: str, response: Dict):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    entry = {'fetched_at': time.time(), 'etag': response.get('etag'), 'response': response}
+    tmp = _cache_path(video_id).with_suffix('.tmp')
+    with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+        json.dump(entry, f, ensure_ascii=False)
+    tmp.replace(_cache_path(video_id))
+
+
+def prune_comment_cache():
+    """CACHE_MAX_AGE 超過を削除し、合計が CACHE_MAX_BYTES を超えたら古い順に削除。"""
+    if not CACHE_DIR.exists():
+        return
+    now = time.time()
+    files = []
+    for path in CACHE_DIR.glob('*.json.gz'):
+        st = path.stat()
+        if now - st.st_mtime > CACHE_MAX_AGE:
+            path.unlink()
+        else:
+            files.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= CACHE_MAX_BYTES:
+            break
+        path.unlink()
+        total -= size
+
+
 # ---------- YouTube コメント解析 ----------
 
-def get_video_comments(youtube, video_id: str, max_results: int = 100) -> List[Dict]:
-    comments = []
+def _fetch_comment_threads(youtube, video_id: str, max_results: int, etag=None, limiter=None):
+    """commentThreads を取得。ETag が一致すれば None（304）。"""
     request = youtube.commentThreads().list(
         part='snippet',
         videoId=video_id,
         maxResults=max_results,
         order='relevance',
     )
+    if etag:
+        request.headers['If-None-Match'] = etag
+    try:
+        return execute(request, limiter)
+    except HttpError as e:
+        if e.resp.status == 304:
+            return None
+        raise
+
+
+def get_video_comments(youtube, video_id: str, max_results: int = 100,
+                       offline: bool = False, limiter=None, refresh: bool = False) -> Optional[List[Dict]]:
+    """コメント一覧。キャッシュが TTL 内ならそれを返し、API は叩かない。
+
+    refresh=True の場合は TTL 内でも ETag で再検証する（コメント数が増えた動画）。
+    offline=True の場合はキャッシュのみ参照する（TTL 無視、なければ空）。
+    取得エラー時は None。
+    """
+    comments = []
+    cached = load_cached_response(video_id)
     try:
-        response = request.execute()
+        if offline:
+            if cached is None:
+                print(f'  キャッシュなし ({video_id})')
+                return comments
+            response = cached['response']
+        elif cached and not refresh and time.time() - cached['fetched_at'] < CACHE_TTL:
+            response = cached['response']
+        else:
+            etag = cached['etag'] if cached else None
+            response = _fetch_comment_threads(youtube, video_id, max_results, etag, limiter)
+            if response is None:
+                response = cached['response']
+            save_cached_response(video_id, response)
+
         for item in response['items']:
             comment = item['snippet']['topLevelComment']['snippet']
             comments.append({
@@ -104,6 +201,7 @@ def get_video_comments(youtube, video_id: str, max_results: int = 100) -> List[D
             })
     except Exception as e:
         print(f'  コメント取得エラー ({video_id}): {e}')
+        return None
     return comments
 
 
@@ -118,98 +216,250 @@ def parse_timestamp(ts: str) -> int:
     return 0
 
 
-def extract_songs_from_comment(text: str) -> List[Tuple[str, str, int]]:
-    """コメントからタイムスタンプと曲情報を抽出。(title, artist, seconds) のリスト。"""
-    text = re.sub(r'<[^>]+>', '', text)
+# 曲名として扱わない行（MC・雑談・感想等）
+SKIP_PATTERNS = [
+    r'^(MC|EN|opening|start|挨拶|お手紙|♫|🎵)',
+    r'(チャンネル登録|カウンター|音量調整)',
+    r'(団長|ドラマ|アレルギー|食べた|語っている|気付く|やりたいこと)',
+    r'^(教師|高校生|結婚できない|占い)',
+    r'「.*」',
+    r'○',
+    r'^\([^)]+\)',
+    r'^(見ていない|に似てる|ですか)',
+    r'の熱帯夜',
+]
+
+
+class SetlistParser:
+    """セットリストコメントのパーサ。正規表現は生成時に一度だけコンパイルする。"""
+
+    def __init__(self, skip_patterns: List[str] = SKIP_PATTERNS):
+        self.tag_re = re.compile(r'<[^>]+>')
+        self.line_re = re.compile(
+            r'(\d{1,2}:\d{2}(?::\d{2})?)\s*(?:\d+\.?)?\s*(.+?)(?=(?:\d{1,2}:\d{2})|$)',
+            re.MULTILINE | re.DOTALL,
+        )
+        self.space_re = re.compile(r'\s+')
+        self.artist_re = re.compile(r'(.+?)\s*[/／\-－]\s*(.+)')
+        self.number_re = re.compile(r'^\d+\.\s*')
+        self.nth_song_re = re.compile(r'^0?\d\s*曲目[:：]\s*')
+        self.skip_re = re.compile('|'.join(f'(?:{p})' for p in skip_patterns), re.IGNORECASE)
+
+    def parse(self, text: str) -> List[Tuple[str, str, int]]:
+        """コメントからタイムスタンプと曲情報を抽出。(title, artist, seconds) のリスト。"""
+        text = self.tag_re.sub('', text)
+
+        songs = []
+        for ts_str, song_info in self.line_re.findall(text):
+            song_info = self.space_re.sub(' ', song_info.strip())
+            if not song_info:
+                continue
+
+            artist_match = self.artist_re.match(song_info)
+            if artist_match:
+                title = artist_match.group(1).strip()
+                artist = artist_match.group(2).strip()
+            else:
+                title = song_info
+                artist = ''
 
-    ts_pat = r'(\d{1,2}:\d{2}(?::\d{2})?)'
-    matches = re.findall(
-        f'{ts_pat}\\s*(?:\\d+\\.?)?\\s*(.+?)(?=(?:\\d{{1,2}}:\\d{{2}})|$)',
-        text, re.MULTILINE | re.DOTALL,
-    )
+            title = self.number_re.sub('', title)
+            title = self.nth_song_re.sub('', title)
 
-    songs = []
-    skip_patterns = [
-        r'^(MC|EN|opening|start|挨拶|お手紙|♫|🎵)',
-        r'(チャンネル登録|カウンター|音量調整)',
-        r'(団長|ドラマ|アレルギー|食べた|語っている|気付く|やりたいこと)',
-        r'^(教師|高校生|結婚できない|占い)',
-        r'「.*」',
-        r'○',
-        r'^\([^)]+\)',
-        r'^(見ていない|に似てる|ですか)',
-        r'の熱帯夜',
-    ]
-
-    for ts_str, song_info in matches:
-        song_info = re.sub(r'\s+', ' ', song_info.strip())
-        if not song_info:
-            continue
-
-        artist_match = re.match(r'(.+?)\s*[/／\-－]\s*(.+)', song_info)
-        if artist_match:
-            title = artist_match.group(1).strip()
-            artist = artist_match.group(2).strip()
-        else:
-            title = song_info
-            artist = ''
+            if self.skip_re.search(title):
+                continue
 
-        title = re.sub(r'^\d+\.\s*', '', title)
-        title = re.sub(r'^0?\d\s*曲目[:：]\s*', '', title)
+            seconds = parse_timestamp(ts_str)
+            if title and len(title) > 2:
+                songs.append((title, artist, seconds))
 
-        if any(re.search(p, title, re.IGNORECASE) for p in skip_patterns):
-            continue
+        return songs
 
-        seconds = parse_timestamp(ts_str)
-        if title and len(title) > 2:
-            songs.append((title, artist, seconds))
 
-    return songs
+_parser = SetlistParser()
+
+
+def extract_songs_from_comment(text: str) -> List[Tuple[str, str, int]]:
+    """コメントからタイムスタンプと曲情報を抽出。(title, artist, seconds) のリスト。"""
+    return _parser.parse(text)
+
+
+# ---------- 抽出状態 ----------
+
+def open_extract_state():
+    """パイプライン（junction テーブル名）× 動画ごとの最終抽出結果を持つ SQLite"""
+    STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(STATE_PATH)
+    conn.row_factory = sqlite3.Row
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS extract_state (
+            pipeline TEXT NOT NULL,
+            video_id TEXT NOT NULL,
+            attempted_at TEXT NOT NULL,
+            comment_count INTEGER,
+            outcome TEXT NOT NULL,
+            song_count INTEGER NOT NULL,
+            parser_version TEXT NOT NULL,
+            PRIMARY KEY (pipeline, video_id)
+        )
+    """)
+    return conn
+
+
+def fetch_comment_counts(youtube, video_ids: List[str],
+                         rate: float = COMMENT_RATE) -> Dict[str, Optional[int]]:
+    """videos.list の statistics.commentCount（50件/1ユニット）。コメント無効は None"""
+    limiter = RateLimiter(rate)
+    counts = {}
+    for i in range(0, len(video_ids), 50):
+        batch = video_ids[i:i + 50]
+        response = execute(youtube.videos().list(part='statistics', id=','.join(batch)), limiter)
+        for item in response.get('items', []):
+            count = item.get('statistics', {}).get('commentCount')
+            counts[item['id']] = int(count) if count is not None else None
+    return counts
+
+
+def select_pending_videos(state, pipeline: str, videos: List[Tuple[str, str]],
+                          comment_counts: Dict[str, Optional[int]]
+                          ) -> Tuple[List[Tuple[str, str]], Set[str]]:
+    """前回から処理し直す必要がある動画と、そのうちコメントキャッシュを使わず取り直す動画 ID を返す。
+
+    対象: 未処理 / 前回エラー / セットリスト抽出済み（未インポート、中間CSVに残すため）/
+          別の PARSER_VERSION で処理 / 前回よりコメント数が増えた（← キャッシュを再検証）
+    """
+    rows = state.execute(
+        'SELECT * FROM extract_state WHERE pipeline = ?', (pipeline,),
+    ).fetchall()
+    last = {r['video_id']: r for r in rows}
+
+    pending = []
+    refresh = set()
+    for video_id, title in videos:
+        prev = last.get(video_id)
+        grown = prev is not None and (comment_counts.get(video_id) or 0) > (prev['comment_count'] or 0)
+        if grown:
+            refresh.add(video_id)
+        if (
+            prev is None
+            or grown
+            or prev['outcome'] in ('error', 'found')
+            or prev['parser_version'] != PARSER_VERSION
+        ):
+            pending.append((video_id, title))
+    print(f'未抽出: {len(videos)}件, 変化なしでスキップ: {len(videos) - len(pending)}件, '
+          f'処理対象: {len(pending)}件（うちコメント増加: {len(refresh)}件）')
+    return pending, refresh
+
+
+def record_extract_state(state, pipeline: str, results: Dict[str, Tuple[str, int]],
+                         comment_counts: Dict[str, Optional[int]]):
+    """process_videos の結果 {video_id: (outcome, song_count)} を記録"""
+    now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    with state:
+        state.executemany(
+            """INSERT INTO extract_state
+                 (pipeline, video_id, attempted_at, comment_count, outcome, song_count, parser_version)
+               VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(pipeline, video_id) DO UPDATE SET
+                 attempted_at = excluded.attempted_at,
+                 comment_count = excluded.comment_count,
+                 outcome = excluded.outcome,
+                 song_count = excluded.song_count,
+                 parser_version = excluded.parser_version""",
+            [
+                (pipeline, video_id, now, comment_counts.get(video_id), outcome, song_count, PARSER_VERSION)
+                for video_id, (outcome, song_count) in results.items()
+            ],
+        )
 
 
 # ---------- 抽出・出力 ----------
 
-def process_videos(youtube, videos: List[Tuple[str, str]], output_filename: str):
-    """動画リストを処理して中間CSVを data-review/ に出力。"""
+def select_best_setlist(comments: List[Dict]) -> Tuple[List[Tuple[str, str, int]], int]:
+    """曲数最多（同数ならいいね最多、さらに同数なら先勝ち）のコメントのセットリストを選ぶ。"""
+    best_setlist = []
+    best_likes = 0
+    for c in comments:
+        songs = extract_songs_from_comment(c['text'])
+        if songs and (
+            len(songs) > len(best_setlist)
+            or (len(songs) == len(best_setlist) and c['likes'] > best_likes)
+        ):
+            best_setlist = songs
+            best_likes = c['likes']
+    return best_setlist, best_likes
+
+
+# 抽出ロジック（SKIP_PATTERNS / パーサ / セットリスト選択）のソースのハッシュ
+PARSER_VERSION = hashlib.sha1(json.dumps([
+    SKIP_PATTERNS,
+    [inspect.getsource(f) for f in (parse_timestamp, SetlistParser, select_best_setlist)],
+], ensure_ascii=False).encode()).hexdigest()[:12]
+
+
+def process_videos(youtube, videos: List[Tuple[str, str]], output_filename: str,
+                   workers: int = COMMENT_WORKERS, rate: float = COMMENT_RATE,
+                   offline: bool = False, refresh: Set[str] = frozenset()) -> Dict[str, Tuple[str, int]]:
+    """動画リストを処理して中間CSVを data-review/ に出力。
+
+    コメント取得は workers 並列（全体で rate リクエスト/秒まで）。
+    解析・CSV 書き込みは入力順に行うため、出力は逐次処理と同一。
+    offline=True の場合はキャッシュ済みコメントのみで抽出する。
+    refresh の動画はコメントキャッシュを TTL 内でも再検証する。
+
+    戻り値: {video_id: (outcome, song_count)}
+      outcome: found / no_setlist / no_comments / error
+    """
     REVIEW_DIR.mkdir(parents=True, exist_ok=True)
     output_path = REVIEW_DIR / output_filename
 
     fieldnames = ['video_id', 'video_title', 'song_title', 'artist', 'start_seconds']
+    limiter = RateLimiter(rate)
+    results = {}
 
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+    def fetch(video):
+        return get_video_comments(youtube, video[0], offline=offline, limiter=limiter,
+                                  refresh=video[0] in refresh)
+
+    with open(output_path, 'w', newline='', encoding='utf-8') as f, \
+            ThreadPoolExecutor(max_workers=workers) as pool:
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
 
-        for i, (video_id, video_title) in enumerate(videos, 1):
-            print(f'  ({i}/{len(videos)}) {video_title[:50]} ({video_id})')
-
-            comments = get_video_comments(youtube, video_id)
-            print(f'    コメント: {len(comments)}件')
-
-            best_setlist = []
-            best_likes = 0
-            for c in comments:
-                songs = extract_songs_from_comment(c['text'])
-                if songs and (
-                    len(songs) > len(best_setlist)
-                    or (len(songs) == len(best_setlist) and c['likes'] > best_likes)
-                ):
-                    best_setlist = songs
-                    best_likes = c['likes']
-
-            if best_setlist:
-                print(f'    抽出: {len(best_setlist)}曲 (いいね: {best_likes})')
-                for title, artist, seconds in best_setlist:
-                    writer.writerow({
-                        'video_id': video_id,
-                        'video_title': video_title,
-                        'song_title': title,
-                        'artist': artist,
-                        'start_seconds': seconds,
-                    })
-            else:
-                print(f'    セットリスト未検出')
-
-            time.sleep(1)
-
+        # pool.map は入力順に結果を返す（取得は先行して並列に進む）
+        try:
+            for i, ((video_id, video_title), comments) in enumerate(
+                zip(videos, pool.map(fetch, videos)), 1,
+            ):
+                print(f'  ({i}/{len(videos)}) {video_title[:50]} ({video_id})')
+                if comments is None:
+                    results[video_id] = ('error', 0)
+                    continue
+                print(f'    コメント: {len(comments)}件')
+
+                best_setlist, best_likes = select_best_setlist(comments)
+
+                if best_setlist:
+                    print(f'    抽出: {len(best_setlist)}曲 (いいね: {best_likes})')
+                    for title, artist, seconds in best_setlist:
+                        writer.writerow({
+                            'video_id': video_id,
+                            'video_title': video_title,
+                            'song_title': title,
+                            'artist': artist,
+                            'start_seconds': seconds,
+                        })
+                    results[video_id] = ('found', len(best_setlist))
+                else:
+                    print(f'    セットリスト未検出')
+                    results[video_id] = ('no_setlist' if comments else 'no_comments', 0)
+        except BaseException:
+            # Ctrl-C 等: 未着手の取得は捨てる（実行中の分だけ待つ）
+            pool.shutdown(cancel_futures=True)
+            raise
+
+    if not offline:
+        prune_comment_cache()
     print(f'\n  {output_path.name} に保存')
+    return results
@@ -0,0 +1,27 @@
+"""ホットクエリの SQL（extract_songs_common / stream_tag_extractor / db_indexes 共通）
+
+db_indexes が実行計画をチェックするため、依存ライブラリなしで import できるようにここに置く。
+"""
+
+# extract_songs_common.get_tagged_video_ids: タグ → 配信動画
+TAGGED_VIDEOS_SQL = """
+    SELECT v.id, v.title, v.published_at
+    FROM videos v
+    JOIN video_stream_tags vst ON v.id = vst.video_id
+    JOIN stream_tags st ON vst.tag_id = st.id
+    WHERE st.name = ?
+      AND v.id NOT IN (SELECT video_id FROM hidden_streams)
+    ORDER BY v.published_at DESC
+"""
+
+# stream_tag_extractor.load_stream_data: 配信動画一覧
+STREAM_DATA_SQL = """
+    SELECT v.id, v.title, v.duration,
+           COALESCE(sd.started_at, v.published_at) AS started_at
+    FROM videos v
+    JOIN video_video_types vvt ON v.id = vvt.video_id
+    JOIN video_types vt ON vvt.video_type_id = vt.id
+    LEFT JOIN stream_details sd ON v.id = sd.video_id
+    WHERE vt.type = 'stream'
+      AND v.id NOT IN (SELECT video_id FROM hidden_streams)
+"""
@@ -6,22 +6,27 @@ CSVから music_videos テーブルにデータを反映する。
   列: song_title, video_id, type (original|cover)
 
 処理:
-  - song_title で既存 songs を照合（正規化マッチ）
+  - song_title で既存 songs を照合（song_index.SongIndex、正規化後の完全一致）
   - 既存曲 → song_id 再利用
+  - 完全一致しないが類似曲あり → 表記ゆれとしてレポートし登録しない（--new-title で曲ごと、--force-new で全件を新曲扱い）
   - 新曲 → UUID 生成、artist='TODO' で songs に追加
   - music_videos テーブルに挿入（重複は無視）
+  - CSV は 1 行ずつ読み、csv_import.BATCH_SIZE 件ごとに 1 トランザクションで書き込む
 
 使い方:
   python3 music_videos_importer.py
+  python3 music_videos_importer.py --force-new  # 類似曲があっても新曲として登録
+  python3 music_videos_importer.py --new-title "曲名"  # 指定タイトルだけ類似曲があっても新曲として登録
 """
 
-import csv
-import re
+import argparse
 import sys
 import uuid
 from pathlib import Path
 
-from db import get_connection
+from csv_import import import_batches, read_review_csv
+from db import analyze, get_connection, upsert_rows
+from song_index import SongIndex, report_similar
 
 ROOT = Path(__file__).resolve().parent.parent  # tools/
 REVIEW_DIR = ROOT / 'data-review'
@@ -32,43 +37,36 @@ TYPE_MAP = {
 }
 
 
-def normalize_title(title: str) -> str:
-    n = title.lower()
-    n = re.sub(r'[　\s]+', '', n)
-    n = re.sub(r'[!！?？～〜・♪♫]', '', n)
-    n = re.sub(r'[（）()「」『』【】]', '', n)
-    return n
-
-
 def main():
+    parser = argparse.ArgumentParser(description='music_videos.csv → music_videos')
+    parser.add_argument('--force-new', action='store_true', help='類似曲があっても新曲として登録')
+    parser.add_argument('--new-title', action='append', default=[], metavar='TITLE',
+                        help='類似曲があってもこのタイトルは新曲として登録（複数指定可）')
+    args = parser.parse_args()
+
     csv_path = REVIEW_DIR / 'music_videos.csv'
     if not csv_path.exists():
         print(f'エラー: {csv_path} が見つかりません')
         sys.exit(1)
 
-    with open(csv_path, newline='', encoding='utf-8') as f:
-        rows = list(csv.DictReader(f))
-    if not rows:
-        print(f'エラー: {csv_path} が空です')
-        sys.exit(1)
-    print(f'入力CSV: {len(rows)}件')
-
-    # type 列の検証
-    for i, row in enumerate(rows, 1):
+    # 1 パス目: type 列の検証（不正があれば DB に触れずに終了）
+    read = 0
+    for i, row in enumerate(read_review_csv(csv_path), 1):
+        read = i
         t = row.get('type', '').strip()
         if t not in TYPE_MAP:
             print(f'エラー: {i}行目の type が不正です: "{t}" (original|cover のいずれか)')
             sys.exit(1)
+    if not read:
+        print(f'エラー: {csv_path} が空です')
+        sys.exit(1)
+    print(f'入力CSV: {read}件')
 
     conn = get_connection()
 
     # 既存曲マスタ読み込み
-    songs_rows = conn.execute('SELECT id, title FROM songs').fetchall()
-    songs_index = {}  # normalized_title → (song_id, original_title)
-    for s in songs_rows:
-        key = normalize_title(s['title'])
-        songs_index[key] = (s['id'], s['title'])
-    print(f'既存曲マスタ: {len(songs_rows)}件')
+    songs_index = SongIndex.from_db(conn)
+    print(f'既存曲マスタ: {len(songs_index)}件')
 
     # 既存 music_videos 件数
     existing_count = conn.execute('SELECT COUNT(*) FROM music_videos').fetchone()[0]
@@ -79,59 +77,61 @@ def main():
         r[0] for r in conn.execute('SELECT id FROM videos').fetchall()
     }
 
-    # 挿入処理
-    new_songs = 0
-    added = 0
-    skipped = 0
+    # 2 パス目: 正規化（1 行ずつ読み、(新曲 or None, music_videos 行) を返す）
     missing_videos = []
-
-    conn.execute('BEGIN')
-    for row in rows:
-        title = row['song_title'].strip()
-        video_id = row['video_id'].strip()
-        mv_type = row['type'].strip()
-
-        # video_id が videos テーブルに存在するか確認
-        if video_id not in video_ids_in_db:
-            missing_videos.append((title, video_id))
-            continue
-
-        # 楽曲の照合
-        key = normalize_title(title)
-        match = songs_index.get(key)
-        if match:
-            song_id = match[0]
-        else:
-            song_id = str(uuid.uuid4())
-            songs_index[key] = (song_id, title)
-            conn.execute(
-                'INSERT INTO songs (id, title, artist) VALUES (?, ?, ?)',
-                (song_id, title, 'TODO'),
-            )
-            new_songs += 1
-
-        try:
-            conn.execute(
-                'INSERT INTO music_videos (song_id, video_id, music_video_type_id) VALUES (?, ?, ?)',
-                (song_id, video_id, TYPE_MAP[mv_type]),
-            )
-            added += 1
-        except Exception:
-            skipped += 1  # 重複
-
-    conn.execute('COMMIT')
+    similar_skipped = []
+    new_titles = set(args.new_title)
+
+    def normalized_rows():
+        for row in read_review_csv(csv_path):
+            title = row['song_title'].strip()
+            video_id = row['video_id'].strip()
+            mv_type = row['type'].strip()
+
+            # video_id が videos テーブルに存在するか確認
+            if video_id not in video_ids_in_db:
+                missing_videos.append((title, video_id))
+                continue
+
+            # 楽曲の照合
+            new_song = None
+            song_id = songs_index.get(title)
+            if not song_id:
+                candidates = [] if args.force_new or title in new_titles else songs_index.similar(title)
+                if candidates:
+                    similar_skipped.append((title, candidates))
+                    continue
+                song_id = str(uuid.uuid4())
+                songs_index.add(song_id, title)
+                new_song = (song_id, title, 'TODO')
+
+            yield new_song, (song_id, video_id, TYPE_MAP[mv_type])
+
+    def write_batch(conn, batch):
+        # 新曲を先に入れてから music_videos（重複は INSERT OR IGNORE で除外）
+        new_songs = [song for song, _ in batch if song]
+        upsert_rows(conn, 'songs', ['id', 'title', 'artist'], new_songs)
+        result = upsert_rows(
+            conn, 'music_videos', ['song_id', 'video_id', 'music_video_type_id'],
+            (mv for _, mv in batch),
+        )
+        return {'new_songs': len(new_songs), **result}
+
+    result = import_batches(conn, normalized_rows(), write_batch)
+    analyze(conn)
 
     if missing_videos:
         print(f'\n=== videos テーブルに存在しない video_id（{len(missing_videos)}件） ===')
         for title, vid in missing_videos:
             print(f'  {title}: {vid}')
         print('先に youtube_data_fetcher.py で動画データを取得してください')
+    report_similar(similar_skipped)
 
     final_count = conn.execute('SELECT COUNT(*) FROM music_videos').fetchone()[0]
     conn.close()
 
     print(f'\nmusic_videos: {existing_count}件 → {final_count}件')
-    print(f'追加: {added}件, 重複スキップ: {skipped}件, 新曲作成: {new_songs}件')
+    print(f'追加: {result["inserted"]}件, 重複スキップ: {result["ignored"]}件, 新曲作成: {result["new_songs"]}件, 表記ゆれ保留: {len(similar_skipped)}件')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,36 @@
+"""共有レートリミッタ（YouTube / Spotify API 呼び出し用）"""
+
+import threading
+import time
+
+
+class RateLimiter:
+    """トークンバケット方式のレートリミッタ。複数スレッドから共有する。"""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.resume_at:
+                    wait = self.resume_at - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """全スレッドの取得を seconds 秒止める（429 Retry-After 用）。"""
+        with self._lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
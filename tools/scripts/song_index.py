@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+楽曲タイトルのインメモリ索引（songs_importer / music_videos_importer / update_song_artists 共通）。
+
+  - normalize_title: タイトル正規化（全スクリプトでこれ 1 つを使う）
+  - SongIndex.get:     正規化タイトルの完全一致（dict で O(1)）
+  - SongIndex.similar: 表記ゆれ候補。カバー / ver. / アレンジ等の付記を除いた基底タイトルで比べる
+      基底タイトルが一致 → 1.0（"Song (Cover)" と "Song"、短いタイトルもこれで拾う）
+      それ以外 → 基底タイトルの文字 3-gram の Dice 係数（2 × 共通 gram 数 / 両者の gram 数の和）
+
+Dice は対称なので、長いタイトルが短いタイトルを含むだけ（"Love" と "Love Song" 等）では高くならない。
+
+単体実行で既存 songs の重複候補をレポートする:
+  python3 song_index.py
+  python3 song_index.py --threshold 0.9
+"""
+
+import argparse
+import re
+from collections import Counter, defaultdict
+
+from db import get_readonly_connection
+
+GRAM_SIZE = 3
+SIMILARITY_THRESHOLD = 0.8
+# gram 数がこれ未満の短いタイトルは Dice を使わず基底タイトルの一致だけを見る（「恋」「LOVE」等の誤検出防止）
+MIN_GRAMS = 2
+
+# 末尾の付記（括弧・区切り記号・空白のいずれかの後ろにあるものだけ。"Undercover" 等は残す）
+VARIANT_SUFFIX_RE = re.compile(
+    r'(?:[\s　]+|[\s　]*[(（\[【\-－~〜/／])[\s　]*'
+    r'(?:cover(?:ed)?|arranged?|acoustic|remix|short|full|(?:[^\s()（）\[\]【】]+[\s　]*)?ver\.?|version'
+    r'|弾き語り|アレンジ|カバー|歌ってみた)'
+    r'[\s　]*[)）\]】\-－~〜]?[\s　]*$',
+    re.IGNORECASE,
+)
+
+
+def normalize_title(title: str) -> str:
+    n = title.lower()
+    n = re.sub(r'[　\s]+', '', n)
+    n = re.sub(r'[!！?？～〜・♪♫]', '', n)
+    n = re.sub(r'[（）()「」『』【】]', '', n)
+    return n
+
+
+def base_title(title: str) -> str:
+    """付記を除いた正規化タイトル（付記しかなければ正規化タイトルそのもの）"""
+    stripped = title
+    while (m := VARIANT_SUFFIX_RE.search(stripped)) and m.start() > 0:
+        stripped = stripped[:m.start()]
+    return normalize_title(stripped) or normalize_title(title)
+
+
+def grams(key: str) -> set:
+    if len(key) < GRAM_SIZE:
+        return {key}
+    return {key[i:i + GRAM_SIZE] for i in range(len(key) - GRAM_SIZE + 1)}
+
+
+class SongIndex:
+    """正規化タイトル → song_id の完全一致索引 + 3-gram 類似候補索引"""
+
+    def __init__(self, rows=()):
+        self._by_key = {}                  # normalized_title → song_id
+        self._titles = {}                  # song_id → 元タイトル
+        self._base = {}                    # normalized_title → 基底タイトル
+        self._by_base = defaultdict(set)   # 基底タイトル → {normalized_title}
+        self._grams = {}                   # normalized_title → {基底タイトルの gram}
+        self._postings = defaultdict(set)  # gram → {normalized_title}
+        self.collisions = []               # 正規化後に同一になった (song_id, song_id)
+        for song_id, title in rows:
+            self.add(song_id, title)
+
+    @classmethod
+    def from_db(cls, conn):
+        rows = conn.execute('SELECT id, title FROM songs').fetchall()
+        return cls((r['id'], r['title']) for r in rows)
+
+    def __len__(self):
+        return len(self._titles)
+
+    def add(self, song_id, title):
+        key = normalize_title(title)
+        self._titles[song_id] = title
+        if key in self._by_key:
+            self.collisions.append((self._by_key[key], song_id))
+        self._by_key[key] = song_id
+        if key not in self._grams:
+            base = base_title(title)
+            self._base[key] = base
+            self._by_base[base].add(key)
+            g = grams(base)
+            self._grams[key] = g
+            for gram in g:
+                self._postings[gram].add(key)
+
+    def get(self, title):
+        """完全一致（正規化後）の song_id。なければ None"""
+        return self._by_key.get(normalize_title(title))
+
+    def title(self, song_id):
+        return self._titles[song_id]
+
+    def similar(self, title, threshold=SIMILARITY_THRESHOLD, limit=5):
+        """完全一致以外の類似候補 [(song_id, title, score)]（score 降順）"""
+        key = normalize_title(title)
+        base = base_title(title)
+        scores = {other: 1.0 for other in self._by_base.get(base, ())}
+
+        query = grams(base)
+        if len(query) >= MIN_GRAMS:
+            overlap = Counter()
+            for gram in query:
+                overlap.update(self._postings.get(gram, ()))
+            for other, common in overlap.items():
+                other_size = len(self._grams[other])
+                if other in scores or other_size < MIN_GRAMS:
+                    continue
+                score = 2 * common / (len(query) + other_size)
+                if score >= threshold:
+                    scores[other] = score
+
+        results = []
+        for other, score in scores.items():
+            if other != key:
+                song_id = self._by_key[other]
+                results.append((song_id, self._titles[song_id], score))
+        results.sort(key=lambda r: -r[2])
+        return results[:limit]
+
+    def near_duplicates(self, threshold=SIMILARITY_THRESHOLD):
+        """索引内の重複候補ペア [(song_id, song_id, score)]（各ペア 1 回）"""
+        pairs = [(a, b, 1.0) for a, b in self.collisions]
+        for song_id in self._by_key.values():
+            for other_id, _, score in self.similar(self._titles[song_id], threshold, limit=None):
+                if song_id < other_id:
+                    pairs.append((song_id, other_id, score))
+        return pairs
+
+
+def report_similar(skipped):
+    """類似候補ありで保留した行のレポート。skipped: [(title, [(song_id, title, score)])]"""
+    if not skipped:
+        return
+    rows = Counter(title for title, _ in skipped)
+    candidates = {title: c for title, c in skipped}
+    print(f'\n=== 既存曲と表記ゆれの可能性（{len(rows)}曲 / {len(skipped)}行、未登録） ===')
+    for title, count in rows.items():
+        print(f'  "{title}"（{count}行）')
+        for _, existing, score in candidates[title]:
+            print(f'    ≈ "{existing}" ({score:.2f})')
+    print('CSV のタイトルを既存曲に合わせるか、別曲なら --new-title "<タイトル>" を付けて再実行してください')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='songs の重複候補レポート')
+    parser.add_argument('--threshold', type=float, default=SIMILARITY_THRESHOLD)
+    args = parser.parse_args()
+
+    conn = get_readonly_connection()
+    index = SongIndex.from_db(conn)
+    conn.close()
+
+    pairs = index.near_duplicates(args.threshold)
+    print(f'songs: {len(index)}件, 重複候補: {len(pairs)}組')
+    for a, b, score in sorted(pairs, key=lambda p: -p[2]):
+        print(f'  {score:.2f}  "{index.title(a)}" ({a}) ≈ "{index.title(b)}" ({b})')
+
+
+if __name__ == '__main__':
+    main()
@@ -7,113 +7,127 @@
 出力: songs テーブル, stream_songs or concert_songs テーブル
 
 処理:
-  - song_title で既存 songs を照合
+  - song_title で既存 songs を照合（song_index.SongIndex、正規化後の完全一致）
   - 既存曲 → song_id 再利用
+  - 完全一致しないが類似曲あり → 表記ゆれとしてレポートし登録しない（--new-title で曲ごと、--force-new で全件を新曲扱い）
   - 新曲 → UUID 生成、artist は中間CSVの値（なければ 'TODO'）
   - junction テーブルに追加（重複排除）
+  - 中間CSVは 1 行ずつ読み、csv_import.BATCH_SIZE 件ごとに 1 トランザクションで書き込む
 
 使い方:
   python3 songs_importer.py stream   # 歌枠
   python3 songs_importer.py live     # ライブ
+  python3 songs_importer.py stream --force-new  # 類似曲があっても新曲として登録
+  python3 songs_importer.py stream --new-title "曲名"  # 指定タイトルだけ類似曲があっても新曲として登録
 """
 
-import csv
-import re
+import argparse
 import sys
 import uuid
 from pathlib import Path
 
-from db import get_connection
+from csv_import import import_batches, read_review_csv
+from db import analyze, get_connection, upsert_rows
+from song_index import SongIndex, report_similar
 
 ROOT = Path(__file__).resolve().parent.parent  # tools/
 REVIEW_DIR = ROOT / 'data-review'
 
 
-def normalize_title(title: str) -> str:
-    n = title.lower()
-    n = re.sub(r'[　\s]+', '', n)
-    n = re.sub(r'[!！?？～〜・♪♫]', '', n)
-    n = re.sub(r'[（）()「」『』【】]', '', n)
-    return n
-
-
 def main():
-    if len(sys.argv) < 2 or sys.argv[1] not in ('stream', 'live'):
-        print('使い方: python3 songs_importer.py stream|live')
-        sys.exit(1)
-
-    mode = sys.argv[1]
-    if mode == 'stream':
+    parser = argparse.ArgumentParser(description='中間CSV → songs + junction')
+    parser.add_argument('mode', choices=['stream', 'live'])
+    parser.add_argument('--force-new', action='store_true', help='類似曲があっても新曲として登録')
+    parser.add_argument('--new-title', action='append', default=[], metavar='TITLE',
+                        help='類似曲があってもこのタイトルは新曲として登録（複数指定可）')
+    args = parser.parse_args()
+
+    if args.mode == 'stream':
         input_file = 'extracted_songs_stream.csv'
         junction_table = 'stream_songs'
     else:
         input_file = 'extracted_songs_live.csv'
         junction_table = 'concert_songs'
 
-    # 中間CSV読み込み（data-review/）
     extracted_path = REVIEW_DIR / input_file
     if not extracted_path.exists():
         print(f'エラー: {extracted_path} が見つかりません')
         sys.exit(1)
-
-    with open(extracted_path, newline='', encoding='utf-8') as f:
-        extracted = list(csv.DictReader(f))
-    if not extracted:
-        print(f'エラー: {extracted_path} が空です')
-        sys.exit(1)
-    print(f'中間CSV: {len(extracted)}件 ({input_file})')
-
     conn = get_connection()
 
     # 既存曲マスタ読み込み
-    songs_rows = conn.execute('SELECT id, title FROM songs').fetchall()
-    songs_index = {}  # normalized_title → song_id
-    for row in songs_rows:
-        key = normalize_title(row['title'])
-        songs_index[key] = row['id']
-    print(f'既存曲マスタ: {len(songs_rows)}件')
+    songs_index = SongIndex.from_db(conn)
+    print(f'既存曲マスタ: {len(songs_index)}件')
 
     # 既存 junction 件数
     existing_count = conn.execute(f'SELECT COUNT(*) FROM {junction_table}').fetchone()[0]
     print(f'既存 junction: {existing_count}件 ({junction_table})')
 
-    # 正規化・挿入
-    new_songs = 0
-    junction_added = 0
-
-    conn.execute('BEGIN')
-    for row in extracted:
-        title = row['song_title']
-        artist = row.get('artist', '') or 'TODO'
-        key = normalize_title(title)
-
-        song_id = songs_index.get(key)
-        if not song_id:
-            song_id = str(uuid.uuid4())
-            songs_index[key] = song_id
-            conn.execute(
-                'INSERT INTO songs (id, title, artist) VALUES (?, ?, ?)',
-                (song_id, title, artist),
-            )
-            new_songs += 1
-
-        try:
-            conn.execute(
-                f'INSERT INTO {junction_table} (song_id, video_id, start_seconds) VALUES (?, ?, ?)',
-                (song_id, row['video_id'], int(row['start_seconds'])),
-            )
-            junction_added += 1
-        except Exception:
-            pass  # 重複は無視
-
-    conn.execute('COMMIT')
+    # videos テーブルに存在する video_id（FK 違反の事前除外用）
+    video_ids_in_db = {
+        r[0] for r in conn.execute('SELECT id FROM videos').fetchall()
+    }
+
+    # 正規化（中間CSV を 1 行ずつ読み、(新曲 or None, junction 行) を返す）
+    read = 0
+    missing_videos = set()
+    similar_skipped = []
+    new_titles = set(args.new_title)
+
+    def normalized_rows():
+        nonlocal read
+        for row in read_review_csv(extracted_path):
+            read += 1
+            title = row['song_title']
+            artist = row.get('artist', '') or 'TODO'
+
+            if row['video_id'] not in video_ids_in_db:
+                missing_videos.add(row['video_id'])
+                continue
+
+            new_song = None
+            song_id = songs_index.get(title)
+            if not song_id:
+                candidates = [] if args.force_new or title in new_titles else songs_index.similar(title)
+                if candidates:
+                    similar_skipped.append((title, candidates))
+                    continue
+                song_id = str(uuid.uuid4())
+                songs_index.add(song_id, title)
+                new_song = (song_id, title, artist)
+
+            yield new_song, (song_id, row['video_id'], int(row['start_seconds']))
+
+    def write_batch(conn, batch):
+        # 新曲を先に入れてから junction（重複は INSERT OR IGNORE で除外）
+        new_songs = [song for song, _ in batch if song]
+        upsert_rows(conn, 'songs', ['id', 'title', 'artist'], new_songs)
+        result = upsert_rows(
+            conn, junction_table, ['song_id', 'video_id', 'start_seconds'],
+            (junction for _, junction in batch),
+        )
+        return {'new_songs': len(new_songs), **result}
+
+    result = import_batches(conn, normalized_rows(), write_batch)
+    if not read:
+        print(f'エラー: {extracted_path} が空です')
+        conn.close()
+        sys.exit(1)
+    analyze(conn)
+    print(f'中間CSV: {read}件 ({input_file})')
+
+    if missing_videos:
+        print(f'\n=== videos テーブルに存在しない video_id（{len(missing_videos)}件） ===')
+        for vid in sorted(missing_videos):
+            print(f'  {vid}')
+    report_similar(similar_skipped)
 
     final_songs = conn.execute('SELECT COUNT(*) FROM songs').fetchone()[0]
     final_junction = conn.execute(f'SELECT COUNT(*) FROM {junction_table}').fetchone()[0]
     conn.close()
 
     print(f'\nsongs: {final_songs}件, {junction_table}: {final_junction}件')
-    print(f'新曲: {new_songs}件, junction追加: {junction_added}件')
+    print(f'新曲: {result["new_songs"]}件, junction追加: {result["inserted"]}件, 重複スキップ: {result["ignored"]}件, 表記ゆれ保留: {len(similar_skipped)}件')
 
 
 if __name__ == '__main__':
@@ -21,17 +21,37 @@
 
 import argparse
 import csv
+import hashlib
+import inspect
+import json
 import re
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional, Set
 
 from db import get_readonly_connection
+from hot_queries import STREAM_DATA_SQL
 
 ROOT = Path(__file__).resolve().parent.parent  # tools/
 REVIEW_DIR = ROOT / 'data-review'
 
+# 特殊ルール（classify 参照）
+EPISODE_RE = re.compile(r'#\d+(?=[\s【\]】]|$)')
+MILESTONE_RE = re.compile(r'\d+周年|\d+万人|\d+日記念')
+MILESTONE_EXCLUDE_KW = ['耐久', '歌枠', 'まで歌']
+LIVE_RE = re.compile(
+    r'3D\s*LIVE|3D\s*ライブ|3DLIVE|生誕.*LIVE|Birthday.*Live|Anniversary.*LIVE',
+    re.IGNORECASE,
+)
+LIVE_EXCLUDE_KW = ['雑談', 'お礼', 'スパチャ', '告知', 'お知らせ', '朝活', '感想会', '振り返り']
+
+# --verify の分類結果キャッシュ。キーワードテーブルと特殊ルールのソースが変われば捨てる（rules_hash）
+VERIFY_CACHE_PATH = REVIEW_DIR / '.cache' / 'verify_classifications.json'
+# 未キャッシュ件数がこれ未満ならプロセスプールを使わない（起動コストの方が大きい）
+PARALLEL_THRESHOLD = 500
+
 
 # ---------- データ読み込み ----------
 
@@ -52,16 +72,7 @@ def load_tag_keywords(conn) -> Dict[int, List[str]]:
 
 def load_stream_data(conn):
     """配信データを読み込み → {video_id: {title, duration, started_at}}"""
-    rows = conn.execute("""
-        SELECT v.id, v.title, v.duration,
-               COALESCE(sd.started_at, v.published_at) AS started_at
-        FROM videos v
-        JOIN video_video_types vvt ON v.id = vvt.video_id
-        JOIN video_types vt ON vvt.video_type_id = vt.id
-        LEFT JOIN stream_details sd ON v.id = sd.video_id
-        WHERE vt.type = 'stream'
-          AND v.id NOT IN (SELECT video_id FROM hidden_streams)
-    """).fetchall()
+    rows = conn.execute(STREAM_DATA_SQL).fetchall()
 
     return {r['id']: {
         'title': r['title'],
@@ -87,6 +98,66 @@ def load_published_at_map(conn) -> Dict[str, str]:
 
 # ---------- 分類エンジン ----------
 
+class KeywordMatcher:
+    """tag_keywords から構築する Aho-Corasick オートマトン。
+
+    タイトルを 1 回走査するだけで、含まれる全キーワード（重なりも含む）の tag_id を返す。
+    """
+
+    def __init__(self, tag_keywords: Dict[int, List[str]]):
+        self.tag_keywords = tag_keywords
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[Dict[int, str]] = [{}]  # node → {tag_id: keyword}
+        self.always: Dict[int, str] = {}  # 空文字キーワード（`'' in title` は常に真）
+
+        for tag_id, keywords in tag_keywords.items():
+            for kw in keywords:
+                if not kw:
+                    self.always.setdefault(tag_id, kw)
+                    continue
+                node = 0
+                for ch in kw:
+                    nxt = self.goto[node].get(ch)
+                    if nxt is None:
+                        nxt = len(self.goto)
+                        self.goto[node][ch] = nxt
+                        self.goto.append({})
+                        self.fail.append(0)
+                        self.out.append({})
+                    node = nxt
+                self.out[node].setdefault(tag_id, kw)
+
+        # 失敗リンク（BFS）
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                for tag_id, kw in self.out[self.fail[nxt]].items():
+                    self.out[nxt].setdefault(tag_id, kw)
+
+    def match_keywords(self, text: str) -> Dict[int, str]:
+        """text に含まれるキーワード → {tag_id: 最初にヒットしたキーワード}"""
+        matched = dict(self.always)
+        node = 0
+        for ch in text:
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for tag_id, kw in self.out[node].items():
+                matched.setdefault(tag_id, kw)
+        return matched
+
+    def match(self, text: str) -> Set[int]:
+        """text に含まれるキーワードの tag_id 集合。"""
+        return set(self.match_keywords(text))
+
+
 def extract_time_features(started_at: Optional[str]) -> Dict:
     if not started_at:
         return {}
@@ -98,14 +169,16 @@ def extract_time_features(started_at: Optional[str]) -> Dict:
 
 
 def classify(title: str, duration: Optional[str], started_at: Optional[str],
-             tag_master: Dict[int, str], tag_keywords: Dict[int, List[str]]) -> Set[int]:
+             matcher: KeywordMatcher) -> Set[int]:
     """タグ判定。キーワードCSV + 特殊ルール + フォールバックの3段構成。"""
-    matched: Set[int] = set()
+    return set(explain(title, duration, started_at, matcher))
 
+
+def explain(title: str, duration: Optional[str], started_at: Optional[str],
+            matcher: KeywordMatcher) -> Dict[int, str]:
+    """classify の判定根拠付き版。{tag_id: ヒットしたキーワード or 'rule:…'}"""
     # --- Phase 1: キーワードマッチ（DB駆動） ---
-    for tag_id, keywords in tag_keywords.items():
-        if any(kw in title for kw in keywords):
-            matched.add(tag_id)
+    matched: Dict[int, str] = matcher.match_keywords(title)
 
     # --- Phase 2: 特殊ルール ---
     time_feat = extract_time_features(started_at)
@@ -113,27 +186,24 @@ def classify(title: str, duration: Optional[str], started_at: Optional[str],
     # 雑談(1): 朝(0-12時) × 朝キーワード
     if 1 not in matched:
         if time_feat.get('is_morning', False) and 'おは' in title:
-            matched.add(1)
+            matched[1] = 'rule:朝おは'
 
     # ゲーム(2): #数字（エピソード番号）。#数字の直後に非数字文字が続く場合は除外（#3期生 等）
     if 2 not in matched:
-        if re.search(r'#\d+(?=[\s【\]】]|$)', title):
-            matched.add(2)
+        if EPISODE_RE.search(title):
+            matched[2] = 'rule:#話数'
 
     # 記念(8): マイルストーンパターン（ただし耐久/歌枠タイトルは除外）
     if 8 not in matched:
-        if re.search(r'\d+周年|\d+万人|\d+日記念', title):
-            exclude_kw = ['耐久', '歌枠', 'まで歌']
-            if not any(k in title for k in exclude_kw):
-                matched.add(8)
+        if MILESTONE_RE.search(title):
+            if not any(k in title for k in MILESTONE_EXCLUDE_KW):
+                matched[8] = 'rule:記念'
 
     # ライブ(14): タイトル全体で 3D LIVE 系 or 生誕LIVE 系（除外条件あり）
     if 14 not in matched:
-        live_pattern = r'3D\s*LIVE|3D\s*ライブ|3DLIVE|生誕.*LIVE|Birthday.*Live|Anniversary.*LIVE'
-        if re.search(live_pattern, title, re.IGNORECASE):
-            exclude_kw = ['雑談', 'お礼', 'スパチャ', '告知', 'お知らせ', '朝活', '感想会', '振り返り']
-            if not any(k in title for k in exclude_kw):
-                matched.add(14)
+        if LIVE_RE.search(title):
+            if not any(k in title for k in LIVE_EXCLUDE_KW):
+                matched[14] = 'rule:3D LIVE'
 
     return matched
 
@@ -153,7 +223,7 @@ def write_extracted_tags(rows):
     print(f'  extracted_tags.csv: {len(rows)}件')
 
 
-def run_normal(conn, tag_master, tag_keywords):
+def run_normal(conn, tag_master, matcher):
     """新着のみ分類 → 中間CSV出力。"""
     streams = load_stream_data(conn)
     existing = load_existing_tags(conn)
@@ -170,7 +240,7 @@ def run_normal(conn, tag_master, tag_keywords):
     rows = []
     for vid in sorted(new_ids):
         s = streams[vid]
-        tags = classify(s['title'], s['duration'], s['started_at'], tag_master, tag_keywords)
+        tags = classify(s['title'], s['duration'], s['started_at'], matcher)
         tag_names = sorted([tag_master[t] for t in tags])
         rows.append({
             'video_id': vid,
@@ -190,7 +260,7 @@ def run_normal(conn, tag_master, tag_keywords):
     print(f'\n→ data-review/extracted_tags.csv をレビューしてから just tags-import を実行してください')
 
 
-def run_all(conn, tag_master, tag_keywords):
+def run_all(conn, tag_master, matcher):
     """全件再分類 → 中間CSV出力。"""
     streams = load_stream_data(conn)
     published_map = load_published_at_map(conn)
@@ -199,7 +269,7 @@ def run_all(conn, tag_master, tag_keywords):
     rows = []
     for vid in sorted(streams.keys()):
         s = streams[vid]
-        tags = classify(s['title'], s['duration'], s['started_at'], tag_master, tag_keywords)
+        tags = classify(s['title'], s['duration'], s['started_at'], matcher)
         tag_names = sorted([tag_master[t] for t in tags])
         rows.append({
             'video_id': vid,
@@ -218,20 +288,103 @@ def run_all(conn, tag_master, tag_keywords):
 
 # ---------- 検証モード ----------
 
-def run_verify(conn, tag_master, tag_keywords):
-    """全件再分類 → 人手タグとの精度レポート。"""
+def rules_hash(tag_keywords: Dict[int, List[str]]) -> str:
+    """キーワードテーブル + 特殊ルール（分類関数のソースと正規表現・除外キーワード）のハッシュ。"""
+    table = sorted((tid, sorted(kws)) for tid, kws in tag_keywords.items())
+    source = [inspect.getsource(f) for f in (KeywordMatcher, extract_time_features, explain)]
+    constants = [
+        [EPISODE_RE.pattern, EPISODE_RE.flags],
+        [MILESTONE_RE.pattern, MILESTONE_RE.flags], MILESTONE_EXCLUDE_KW,
+        [LIVE_RE.pattern, LIVE_RE.flags], LIVE_EXCLUDE_KW,
+    ]
+    payload = json.dumps([table, source, constants], ensure_ascii=False)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def input_hash(title: str, started_at: Optional[str]) -> str:
+    return hashlib.sha1(json.dumps([title, started_at], ensure_ascii=False).encode()).hexdigest()
+
+
+def load_verify_cache(rules: str) -> Dict[str, Dict]:
+    """{video_id: {'input': input_hash, 'tags': {tag_id: reason}}}。ルールが変わっていれば空。"""
+    if not VERIFY_CACHE_PATH.exists():
+        return {}
+    try:
+        cache = json.loads(VERIFY_CACHE_PATH.read_text(encoding='utf-8'))
+    except ValueError:
+        return {}
+    if cache.get('rules') != rules:
+        return {}
+    return cache['entries']
+
+
+def save_verify_cache(rules: str, entries: Dict[str, Dict]):
+    VERIFY_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    VERIFY_CACHE_PATH.write_text(
+        json.dumps({'rules': rules, 'entries': entries}, ensure_ascii=False),
+        encoding='utf-8',
+    )
+
+
+_worker_matcher: Optional[KeywordMatcher] = None
+
+
+def _init_worker(tag_keywords):
+    global _worker_matcher
+    _worker_matcher = KeywordMatcher(tag_keywords)
+
+
+def _explain_batch(batch):
+    return [(vid, explain(title, duration, started_at, _worker_matcher))
+            for vid, title, duration, started_at in batch]
+
+
+def explain_all(streams, video_ids, matcher) -> Dict[str, Dict[int, str]]:
+    """video_ids を分類（判定根拠付き）。件数が多ければプロセスプールで並列化。"""
+    if len(video_ids) < PARALLEL_THRESHOLD:
+        return {vid: explain(streams[vid]['title'], streams[vid]['duration'],
+                             streams[vid]['started_at'], matcher)
+                for vid in video_ids}
+
+    rows = [(vid, streams[vid]['title'], streams[vid]['duration'], streams[vid]['started_at'])
+            for vid in video_ids]
+    batches = [rows[i : i + 200] for i in range(0, len(rows), 200)]
+    result = {}
+    with ProcessPoolExecutor(initializer=_init_worker, initargs=(matcher.tag_keywords,)) as pool:
+        for batch_result in pool.map(_explain_batch, batches):
+            result.update(batch_result)
+    return result
+
+
+def run_verify(conn, tag_master, matcher):
+    """全件再分類 → 人手タグとの精度レポート。
+
+    分類結果は (title, started_at, キーワードテーブル + 特殊ルール) 単位でキャッシュし、
+    入力かルールが変わった動画だけ再分類する。
+    """
     streams = load_stream_data(conn)
     existing = load_existing_tags(conn)
 
     target_ids = set(streams.keys()) & set(existing.keys())
-    print(f'検証対象: {len(target_ids)}件（人手タグ付き配信）\n')
+    print(f'検証対象: {len(target_ids)}件（人手タグ付き配信）')
+
+    rules = rules_hash(matcher.tag_keywords)
+    cache = load_verify_cache(rules)
+    inputs = {vid: input_hash(streams[vid]['title'], streams[vid]['started_at']) for vid in target_ids}
+    stale = sorted(vid for vid in target_ids
+                   if vid not in cache or cache[vid]['input'] != inputs[vid])
+    print(f'キャッシュ済み: {len(target_ids) - len(stale)}件, 再分類: {len(stale)}件\n')
+
+    for vid, tags in explain_all(streams, stale, matcher).items():
+        cache[vid] = {'input': inputs[vid], 'tags': {str(tid): reason for tid, reason in tags.items()}}
+    save_verify_cache(rules, {vid: cache[vid] for vid in target_ids})
 
     stats = {tid: {'tp': 0, 'fp': 0, 'fn': 0, 'fp_list': [], 'fn_list': []}
              for tid in tag_master}
 
     for vid in sorted(target_ids):
         s = streams[vid]
-        auto_tags = classify(s['title'], s['duration'], s['started_at'], tag_master, tag_keywords)
+        auto_tags = {int(tid): reason for tid, reason in cache[vid]['tags'].items()}
         human_tags = existing[vid]
 
         for tid in tag_master:
@@ -242,10 +395,10 @@ def run_verify(conn, tag_master, tag_keywords):
                 stats[tid]['tp'] += 1
             elif in_auto and not in_human:
                 stats[tid]['fp'] += 1
-                stats[tid]['fp_list'].append((vid, s['title']))
+                stats[tid]['fp_list'].append((vid, s['title'], auto_tags[tid]))
             elif not in_auto and in_human:
                 stats[tid]['fn'] += 1
-                stats[tid]['fn_list'].append((vid, s['title']))
+                stats[tid]['fn_list'].append((vid, s['title'], ''))
 
     print('=== 精度レポート ===')
     print(f'{"タグ":<12} {"precision":>10} {"recall":>10}    TP    FP    FN')
@@ -265,13 +418,14 @@ def run_verify(conn, tag_master, tag_keywords):
         items = []
         for tid in sorted(tag_master.keys()):
             name = tag_master[tid]
-            for vid, title in stats[tid][key]:
-                items.append((name, vid, title))
+            for vid, title, reason in stats[tid][key]:
+                items.append((name, vid, title, reason))
 
         if items:
             print(f'\n=== {label}: {len(items)}件 ===')
-            for name, vid, title in items[:50]:
-                print(f'  [{name}] {vid} | {title[:60]}')
+            for name, vid, title, reason in items[:50]:
+                cause = f' ← "{reason}"' if reason else ''
+                print(f'  [{name}] {vid} | {title[:60]}{cause}')
             if len(items) > 50:
                 print(f'  ... 他 {len(items) - 50}件')
 
@@ -287,14 +441,15 @@ def main():
     conn = get_readonly_connection()
     tag_master = load_tag_master(conn)
     tag_keywords = load_tag_keywords(conn)
+    matcher = KeywordMatcher(tag_keywords)
     print(f'タグマスタ: {len(tag_master)}種, キーワード: {sum(len(v) for v in tag_keywords.values())}個\n')
 
     if args.verify:
-        run_verify(conn, tag_master, tag_keywords)
+        run_verify(conn, tag_master, matcher)
     elif args.all:
-        run_all(conn, tag_master, tag_keywords)
+        run_all(conn, tag_master, matcher)
     else:
-        run_normal(conn, tag_master, tag_keywords)
+        run_normal(conn, tag_master, matcher)
 
     conn.close()
 
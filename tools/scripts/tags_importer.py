@@ -9,6 +9,8 @@
 処理:
   - tags 列のタグ名 → tag_id に変換
   - 中間CSVに含まれる動画のタグは上書き、それ以外は維持
+  - 1 パス目でタグ名を検証（不明なタグがあれば DB に触れずに終了）
+  - 2 パス目で BATCH_SIZE 件ずつ一時テーブルに積み、set-based に DELETE → INSERT
 
 ワークフロー:
   1. just tags          → extracted_tags.csv 出力
@@ -16,16 +18,64 @@
   3. just tags-import   → video_stream_tags に反映
 """
 
-import csv
 import sys
 from pathlib import Path
 
-from db import get_connection
+from csv_import import import_batches, read_review_csv
+from db import analyze, get_connection
 
 ROOT = Path(__file__).resolve().parent.parent  # tools/
 REVIEW_DIR = ROOT / 'data-review'
 
 
+def parse_tags(row, name_to_id):
+    """tags 列 → ([tag_id, ...], [不明なタグ名, ...])"""
+    tag_ids, unknown = [], []
+    for tag_name in row.get('tags', '').split(','):
+        tag_name = tag_name.strip()
+        if not tag_name:
+            continue
+        tag_id = name_to_id.get(tag_name)
+        if tag_id is None:
+            unknown.append(tag_name)
+        else:
+            tag_ids.append(tag_id)
+    return tag_ids, unknown
+
+
+def create_staging_tables(conn):
+    conn.execute('CREATE TEMP TABLE staged_tags (video_id TEXT NOT NULL, tag_id INTEGER)')
+    conn.execute('CREATE TEMP TABLE reviewed_videos (video_id TEXT PRIMARY KEY)')
+
+
+def write_batch(conn, batch):
+    """バッチ内の動画の既存タグを削除 → 新タグを挿入（一時テーブル経由で set-based に実行）
+
+    batch: [(video_id, tag_id or None)]。tag_id=None はタグなし（既存タグの削除のみ）。
+    同じ動画が複数バッチにまたがっても、削除は初出のバッチでだけ行う。
+    """
+    conn.execute('DELETE FROM temp.staged_tags')
+    conn.executemany('INSERT INTO temp.staged_tags (video_id, tag_id) VALUES (?, ?)', batch)
+
+    before = conn.total_changes
+    conn.execute("""
+        DELETE FROM video_stream_tags
+        WHERE video_id IN (
+            SELECT video_id FROM temp.staged_tags
+            EXCEPT SELECT video_id FROM temp.reviewed_videos
+        )
+    """)
+    deleted = conn.total_changes - before
+    conn.execute('INSERT OR IGNORE INTO temp.reviewed_videos SELECT DISTINCT video_id FROM temp.staged_tags')
+
+    before = conn.total_changes
+    conn.execute("""
+        INSERT OR IGNORE INTO video_stream_tags (video_id, tag_id)
+        SELECT video_id, tag_id FROM temp.staged_tags WHERE tag_id IS NOT NULL
+    """)
+    return {'deleted': deleted, 'inserted': conn.total_changes - before}
+
+
 def main():
     conn = get_connection()
 
@@ -34,44 +84,22 @@ def main():
     name_to_id = {r['name']: r['id'] for r in tag_rows}
     print(f'タグマスタ: {len(name_to_id)}種')
 
-    # 中間CSV読み込み
     extracted_path = REVIEW_DIR / 'extracted_tags.csv'
     if not extracted_path.exists():
         print(f'エラー: {extracted_path} が見つかりません')
         sys.exit(1)
 
-    with open(extracted_path, newline='', encoding='utf-8') as f:
-        extracted = list(csv.DictReader(f))
-    if not extracted:
+    # 1 パス目: タグ名の検証
+    reviewed = 0
+    errors = []
+    for row in read_review_csv(extracted_path):
+        reviewed += 1
+        _, unknown = parse_tags(row, name_to_id)
+        errors.extend((row['video_id'], name) for name in unknown)
+    if not reviewed:
         print(f'エラー: {extracted_path} が空です')
         sys.exit(1)
-    print(f'中間CSV: {len(extracted)}件')
-
-    # 既存タグ件数
-    existing_count = conn.execute('SELECT COUNT(*) FROM video_stream_tags').fetchone()[0]
-    print(f'既存タグ: {existing_count}件')
-
-    # 中間CSVに含まれる video_id を収集
-    reviewed_ids = {row['video_id'] for row in extracted}
-
-    # タグ名 → tag_id に変換
-    new_rows = []
-    errors = []
-    for row in extracted:
-        vid = row['video_id']
-        tags_str = row.get('tags', '').strip()
-        if not tags_str:
-            continue
-
-        for tag_name in tags_str.split(','):
-            tag_name = tag_name.strip()
-            if not tag_name:
-                continue
-            tag_id = name_to_id.get(tag_name)
-            if tag_id is None:
-                errors.append((vid, tag_name))
-                continue
-            new_rows.append((vid, tag_id))
+    print(f'中間CSV: {reviewed}件')
 
     if errors:
         print(f'\n=== 不明なタグ名（{len(errors)}件） ===')
@@ -81,24 +109,31 @@ def main():
         conn.close()
         sys.exit(1)
 
-    # トランザクション内でレビュー対象の既存タグを削除 → 新規挿入
-    conn.execute('BEGIN')
-    for vid in reviewed_ids:
-        conn.execute('DELETE FROM video_stream_tags WHERE video_id = ?', (vid,))
+    # 既存タグ件数
+    existing_count = conn.execute('SELECT COUNT(*) FROM video_stream_tags').fetchone()[0]
+    print(f'既存タグ: {existing_count}件')
+
+    # 2 パス目: (video_id, tag_id) をストリーミングで書き込み
+    tagged = 0
 
-    for vid, tag_id in new_rows:
-        conn.execute(
-            'INSERT OR IGNORE INTO video_stream_tags (video_id, tag_id) VALUES (?, ?)',
-            (vid, tag_id),
-        )
-    conn.execute('COMMIT')
+    def staged_rows():
+        nonlocal tagged
+        for row in read_review_csv(extracted_path):
+            tag_ids, _ = parse_tags(row, name_to_id)
+            if tag_ids:
+                tagged += 1
+            for tag_id in tag_ids or [None]:
+                yield row['video_id'], tag_id
+
+    create_staging_tables(conn)
+    result = import_batches(conn, staged_rows(), write_batch)
+    analyze(conn)
 
     final_count = conn.execute('SELECT COUNT(*) FROM video_stream_tags').fetchone()[0]
-    tagged_videos = len({vid for vid, _ in new_rows})
     conn.close()
 
-    print(f'\nvideo_stream_tags: {final_count}件')
-    print(f'レビュー対象: {len(extracted)}件, タグ付与: {tagged_videos}件, タグなし: {len(extracted) - tagged_videos}件')
+    print(f'\nvideo_stream_tags: {final_count}件（削除: {result["deleted"]}件, 追加: {result["inserted"]}件）')
+    print(f'レビュー対象: {reviewed}件, タグ付与: {tagged}件, タグなし: {reviewed - tagged}件')
 
 
 if __name__ == '__main__':
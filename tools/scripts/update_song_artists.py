@@ -5,22 +5,54 @@ Spotify API で songs テーブルのアーティスト情報を補完する。
 対象: artist が 'TODO' の曲
 出力: songs テーブルを直接更新
 
+検索結果は data-review/.cache/spotify_artists.json に正規化タイトル単位でキャッシュする
+（未検出は NEGATIVE_TTL 経過後に再検索）。キーは song_index.normalize_title の結果なので、
+正規化を変えたら CACHE_VERSION を上げる（旧キャッシュは読み捨てる）。
+
+N 件ごとにコミットし、処理済み song_id を data-review/.cache/update_song_artists.progress.json
+に記録する。中断した場合は --resume で処理済みの曲をスキップして再開できる。
+
 使い方:
   python3 update_song_artists.py
+  python3 update_song_artists.py --resume          # 中断した実行を再開
+  python3 update_song_artists.py --batch-size 100  # コミット間隔
 """
 
+import argparse
+import json
 import os
 import re
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import requests
 import spotipy
+from spotipy.exceptions import SpotifyException
 from spotipy.oauth2 import SpotifyClientCredentials
 
 from db import get_connection
+from rate_limiter import RateLimiter
+from song_index import normalize_title
 
 ROOT = Path(__file__).resolve().parent.parent  # tools/
+CACHE_PATH = ROOT / 'data-review' / '.cache' / 'spotify_artists.json'
+PROGRESS_PATH = ROOT / 'data-review' / '.cache' / 'update_song_artists.progress.json'
+
+# 並列数とレート上限（リクエスト/秒）
+SPOTIFY_WORKERS = 4
+SPOTIFY_RATE = 5.0
+# 2: song_index.normalize_title に統一（♪♫ も除去）
+CACHE_VERSION = 2
+# 未検出の結果を再検索せずに使う期間
+NEGATIVE_TTL = 30 * 24 * 3600
+# コミット間隔（更新件数）
+BATCH_SIZE = 50
+# 429 / 5xx の再試行回数と 5xx のバックオフ基準（秒）
+SEARCH_RETRIES = 5
+BACKOFF_BASE = 1.0
 
 
 # ---------- 環境・API ----------
@@ -35,131 +67,259 @@ def load_env():
                 os.environ.setdefault(key.strip(), value.strip())
 
 
-def init_spotify():
+def init_spotify_auth():
     client_id = os.environ.get('SPOTIFY_CLIENT_ID')
     client_secret = os.environ.get('SPOTIFY_CLIENT_SECRET')
     if not client_id or not client_secret:
         print('エラー: SPOTIFY_CLIENT_ID / SPOTIFY_CLIENT_SECRET が未設定です')
         sys.exit(1)
-    auth = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret)
-    return spotipy.Spotify(auth_manager=auth, language='ja')
+    return SpotifyClientCredentials(client_id=client_id, client_secret=client_secret)
+
+
+def init_spotify(auth):
+    # spotipy が組むセッションは 429 / 5xx を urllib3 でリトライする（retries=0 でも status_forcelist に
+    # 429 が残り、ヘッダのない SpotifyException(429) になる）。ステータスでリトライしない素の Session を渡し、
+    # 429 のレスポンス（Retry-After）をそのまま spotify_search に届ける
+    return spotipy.Spotify(auth_manager=auth, language='ja', requests_session=requests.Session())
+
+
+def spotify_search(sp, limiter, **kwargs):
+    """sp.search をレート制限付きで実行。
+
+    429 は Retry-After 秒、5xx は指数バックオフで全スレッドを止めて SEARCH_RETRIES 回まで再試行。
+    """
+    for attempt in range(SEARCH_RETRIES + 1):
+        limiter.acquire()
+        try:
+            return sp.search(**kwargs)
+        except SpotifyException as e:
+            status = e.http_status or 0
+            if attempt == SEARCH_RETRIES or not (status == 429 or status >= 500):
+                raise
+            if status == 429:
+                wait = int((e.headers or {}).get('Retry-After', 1))
+            else:
+                wait = BACKOFF_BASE * 2 ** attempt
+            print(f'  Spotify {status}: {wait}秒待機 ({attempt + 1}/{SEARCH_RETRIES})')
+            limiter.pause(wait)
+
+
+# ---------- 検索結果キャッシュ ----------
+
+def load_cache():
+    """{normalized_title: {'artist', 'spotify_title', 'searched_at'}}。バージョン違いは空扱い"""
+    if not CACHE_PATH.exists():
+        return {}
+    try:
+        data = json.loads(CACHE_PATH.read_text(encoding='utf-8'))
+    except ValueError:
+        return {}
+    if data.get('version') != CACHE_VERSION:
+        print('Spotify 検索キャッシュ: 正規化ルールが変わったため破棄します')
+        return {}
+    return data['entries']
+
+
+def save_cache(cache):
+    CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = CACHE_PATH.with_suffix('.tmp')
+    tmp.write_text(json.dumps({'version': CACHE_VERSION, 'entries': cache}, ensure_ascii=False), encoding='utf-8')
+    tmp.replace(CACHE_PATH)
+
+
+def cached_result(cache, key):
+    """キャッシュヒット → (artist, spotify_title)。未検出は NEGATIVE_TTL 内のみ有効。ミスは None。"""
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    if entry['artist'] is None and time.time() - entry['searched_at'] > NEGATIVE_TTL:
+        return None
+    return entry['artist'], entry['spotify_title']
+
+
+# ---------- 進捗記録 ----------
+
+def load_progress():
+    """前回実行で処理済みの song_id 集合"""
+    if not PROGRESS_PATH.exists():
+        return set()
+    try:
+        return set(json.loads(PROGRESS_PATH.read_text(encoding='utf-8'))['attempted'])
+    except (ValueError, KeyError):
+        return set()
 
 
-# ---------- Spotify 検索 ----------
+def save_progress(attempted):
+    PROGRESS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = PROGRESS_PATH.with_suffix('.tmp')
+    tmp.write_text(json.dumps({'attempted': sorted(attempted)}), encoding='utf-8')
+    tmp.replace(PROGRESS_PATH)
+
 
-def normalize_title(title):
-    n = title.lower()
-    n = re.sub(r'[　\s]+', '', n)
-    n = re.sub(r'[!！?？～〜・]', '', n)
-    n = re.sub(r'[（）()「」『』【】]', '', n)
-    return n
+# ---------- Spotify 検索 ----------
 
+def search_artist(sp, limiter, song_title):
+    """Spotify API で曲名からアーティストを検索。(artist_name, spotify_title) or (None, None)
 
-def search_artist(sp, song_title):
-    """Spotify API で曲名からアーティストを検索。(artist_name, spotify_title) or (None, None)"""
-    try:
-        results = sp.search(q=song_title, type='track', limit=20, market='JP')
+    API エラーは例外のまま返す（未検出としてキャッシュしないため）。
+    """
+    results = spotify_search(sp, limiter, q=song_title, type='track', limit=20, market='JP')
+    if not results['tracks']['items']:
+        results = spotify_search(sp, limiter, q=song_title, type='track', limit=20)
         if not results['tracks']['items']:
-            results = sp.search(q=song_title, type='track', limit=20)
-            if not results['tracks']['items']:
-                return None, None
-
-        normalized_search = normalize_title(song_title)
-
-        exact = []
-        partial = []
-        for track in results['tracks']['items']:
-            nt = normalize_title(track['name'])
-            if nt == normalized_search:
-                exact.append(track)
-            elif normalized_search in nt or nt in normalized_search or song_title.lower() in track['name'].lower():
-                partial.append(track)
-
-        candidates = exact or partial[:10] or results['tracks']['items'][:5]
-
-        for track in candidates:
-            artist_name = ', '.join(a['name'] for a in track['artists'])
-            if '白銀ノエル' in artist_name:
-                return artist_name, track['name']
-
-        def score(track):
-            s = track['popularity']
-            nt = normalize_title(track['name'])
-            if nt == normalized_search:
-                s += 100
-            rd = track['album']['release_date']
-            if rd and len(rd) >= 4:
-                try:
-                    year = int(rd[:4])
-                    if 1970 <= year <= 2026:
-                        s += (2026 - year) * 1.5
-                except ValueError:
-                    pass
-            at = track['album']['album_type']
-            if at == 'album':
-                s += 30
-            elif at == 'single':
-                s += 20
-            elif at == 'compilation':
-                s -= 10
-            an = track['artists'][0]['name']
-            if re.search(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]', an):
-                s += 40
-            tn = track['name'].lower()
-            anl = an.lower()
-            cover_kw = ['cv.', 'cv：', 'starring', 'feat.', 'cover', 'カバー',
-                        'live', 'ライブ', 'remix', 'リミックス', 'remaster']
-            if any(k in tn or k in anl for k in cover_kw):
-                s -= 50
-            return s
-
-        best = max(candidates, key=score)
-        return ', '.join(a['name'] for a in best['artists']), best['name']
-
-    except Exception as e:
-        print(f'  Spotify検索エラー ({song_title}): {e}')
-        return None, None
+            return None, None
+
+    normalized_search = normalize_title(song_title)
+
+    exact = []
+    partial = []
+    for track in results['tracks']['items']:
+        nt = normalize_title(track['name'])
+        if nt == normalized_search:
+            exact.append(track)
+        elif normalized_search in nt or nt in normalized_search or song_title.lower() in track['name'].lower():
+            partial.append(track)
+
+    candidates = exact or partial[:10] or results['tracks']['items'][:5]
+
+    for track in candidates:
+        artist_name = ', '.join(a['name'] for a in track['artists'])
+        if '白銀ノエル' in artist_name:
+            return artist_name, track['name']
+
+    def score(track):
+        s = track['popularity']
+        nt = normalize_title(track['name'])
+        if nt == normalized_search:
+            s += 100
+        rd = track['album']['release_date']
+        if rd and len(rd) >= 4:
+            try:
+                year = int(rd[:4])
+                if 1970 <= year <= 2026:
+                    s += (2026 - year) * 1.5
+            except ValueError:
+                pass
+        at = track['album']['album_type']
+        if at == 'album':
+            s += 30
+        elif at == 'single':
+            s += 20
+        elif at == 'compilation':
+            s -= 10
+        an = track['artists'][0]['name']
+        if re.search(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]', an):
+            s += 40
+        tn = track['name'].lower()
+        anl = an.lower()
+        cover_kw = ['cv.', 'cv：', 'starring', 'feat.', 'cover', 'カバー',
+                    'live', 'ライブ', 'remix', 'リミックス', 'remaster']
+        if any(k in tn or k in anl for k in cover_kw):
+            s -= 50
+        return s
+
+    best = max(candidates, key=score)
+    return ', '.join(a['name'] for a in best['artists']), best['name']
 
 
 # ---------- メイン ----------
 
 def main():
+    parser = argparse.ArgumentParser(description='Spotify API で TODO 曲のアーティストを補完')
+    parser.add_argument('--resume', action='store_true', help='前回中断した実行の処理済み曲をスキップ')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='コミット間隔（件）')
+    args = parser.parse_args()
+
     load_env()
-    sp = init_spotify()
-    print('Spotify API 接続OK')
+    auth = init_spotify_auth()
 
     conn = get_connection()
     total = conn.execute('SELECT COUNT(*) FROM songs').fetchone()[0]
     todo_rows = conn.execute(
         "SELECT id, title FROM songs WHERE artist = 'TODO'"
     ).fetchall()
-    print(f'全曲: {total}件, TODO: {len(todo_rows)}件\n')
+    print(f'全曲: {total}件, TODO: {len(todo_rows)}件')
+
+    attempted = load_progress() if args.resume else set()
+    if attempted:
+        todo_rows = [row for row in todo_rows if row['id'] not in attempted]
+        print(f'再開: 処理済み {len(attempted)}件をスキップ, 残り {len(todo_rows)}件')
+    print()
 
     if not todo_rows:
         print('更新対象の曲がありません')
         conn.close()
         return
 
+    cache = load_cache()
+    limiter = RateLimiter(SPOTIFY_RATE)
+    local = threading.local()
+    cache_lock = threading.Lock()
+
+    def resolve(title):
+        """(artist, spotify_title, from_cache)。エラー時は (None, None, False) でキャッシュしない。"""
+        key = normalize_title(title)
+        with cache_lock:
+            hit = cached_result(cache, key)
+        if hit is not None:
+            return (*hit, True)
+
+        if not hasattr(local, 'sp'):
+            local.sp = init_spotify(auth)
+        try:
+            artist, spotify_title = search_artist(local.sp, limiter, title)
+        except Exception as e:
+            print(f'  Spotify検索エラー ({title}): {e}')
+            return None, None, False
+
+        with cache_lock:
+            cache[key] = {'artist': artist, 'spotify_title': spotify_title, 'searched_at': time.time()}
+        return artist, spotify_title, False
+
+    def checkpoint():
+        conn.commit()
+        save_progress(attempted)
+        with cache_lock:
+            save_cache(cache)
+
     updated = 0
     not_found = 0
-    for i, row in enumerate(todo_rows, 1):
-        artist, spotify_title = search_artist(sp, row['title'])
-        if artist:
-            conn.execute(
-                'UPDATE songs SET artist = ? WHERE id = ?',
-                (artist, row['id']),
-            )
-            updated += 1
-            print(f'  [{i}/{len(todo_rows)}] {row["title"][:30]:<30} → {artist}')
-        else:
-            not_found += 1
-            print(f'  [{i}/{len(todo_rows)}] {row["title"][:30]:<30} → 未検出')
-        time.sleep(0.1)
-
-    conn.commit()
-    conn.close()
-
-    print(f'\n更新: {updated}件, 未検出: {not_found}件')
+    cache_hits = 0
+    pending = 0
+    try:
+        with ThreadPoolExecutor(max_workers=SPOTIFY_WORKERS) as pool:
+            results = pool.map(resolve, [row['title'] for row in todo_rows])
+            try:
+                for i, (row, (artist, _, from_cache)) in enumerate(zip(todo_rows, results), 1):
+                    cache_hits += from_cache
+                    if artist:
+                        conn.execute(
+                            'UPDATE songs SET artist = ? WHERE id = ?',
+                            (artist, row['id']),
+                        )
+                        updated += 1
+                        print(f'  [{i}/{len(todo_rows)}] {row["title"][:30]:<30} → {artist}')
+                    else:
+                        not_found += 1
+                        print(f'  [{i}/{len(todo_rows)}] {row["title"][:30]:<30} → 未検出')
+
+                    attempted.add(row['id'])
+                    pending += 1
+                    if pending >= args.batch_size:
+                        checkpoint()
+                        pending = 0
+            except BaseException:
+                # Ctrl-C 等: 未着手の検索は捨てる（実行中の分だけ待つ）。再開は --resume で
+                pool.shutdown(cancel_futures=True)
+                raise
+    finally:
+        # 中断時もここまでの結果はコミットして --resume で再開できるようにする
+        checkpoint()
+        conn.close()
+
+    PROGRESS_PATH.unlink(missing_ok=True)
+
+    print(f'\n更新: {updated}件, 未検出: {not_found}件, キャッシュ利用: {cache_hits}件')
 
 
 if __name__ == '__main__':
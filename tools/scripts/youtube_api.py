@@ -0,0 +1,84 @@
+"""
+YouTube Data API 呼び出しの共通ヘルパー（youtube_data_fetcher / extract_songs_common / Lambda 共通）。
+
+  - execute: リクエスト実行。レート制限と 5xx のみ指数バックオフでリトライ
+             （quotaExceeded / forbidden 等の 403 は何度やっても通らないので即失敗）
+  - quota:   消費クォータの集計（list 系は 1 呼び出し 1 ユニット、リトライも消費する）
+  - thread_http: スレッドごとの httplib2.Http（タイムアウト付き）
+
+Lambda にも同梱する（package-lambda.sh）。
+"""
+
+import json
+import random
+import threading
+import time
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+MAX_RETRIES = 3
+BACKOFF_BASE = 1.0
+HTTP_TIMEOUT = 30
+
+# リトライして意味がある 403 / 429 の reason
+RETRYABLE_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+
+class QuotaCounter:
+    """YouTube Data API の消費クォータ（list 系は 1 呼び出し 1 ユニット）を集計する。"""
+
+    def __init__(self):
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def add(self, units=1):
+        with self._lock:
+            self.used += units
+
+    def reset(self):
+        with self._lock:
+            self.used = 0
+
+
+quota = QuotaCounter()
+_thread_local = threading.local()
+
+
+def thread_http():
+    """googleapiclient の Http はスレッドセーフでないため、スレッドごとに持つ。"""
+    if not hasattr(_thread_local, 'http'):
+        _thread_local.http = httplib2.Http(timeout=HTTP_TIMEOUT)
+    return _thread_local.http
+
+
+def error_reason(e: HttpError) -> str:
+    """エラーレスポンスの errors[0].reason（取れなければ空文字）"""
+    try:
+        return json.loads(e.content)['error']['errors'][0]['reason']
+    except (ValueError, KeyError, IndexError, TypeError):
+        return ''
+
+
+def is_retryable(e: HttpError) -> bool:
+    status = e.resp.status
+    return status >= 500 or (status in (403, 429) and error_reason(e) in RETRYABLE_REASONS)
+
+
+def execute(request, limiter=None):
+    """API リクエストを実行。レート制限 / 5xx は指数バックオフでリトライ。
+
+    limiter (rate_limiter.RateLimiter) を渡すと各試行の前に acquire する。
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        if limiter:
+            limiter.acquire()
+        quota.add()
+        try:
+            return request.execute(http=thread_http())
+        except HttpError as e:
+            if attempt == MAX_RETRIES or not is_retryable(e):
+                raise
+            wait = BACKOFF_BASE * 2 ** attempt + random.uniform(0, BACKOFF_BASE)
+            print(f'  HTTP {e.resp.status} {error_reason(e)}: {wait:.1f}秒後にリトライ ({attempt + 1}/{MAX_RETRIES})')
+            time.sleep(wait)
@@ -19,12 +19,13 @@ YouTube Data API から動画データを取得し、SQLite に保存する。
 import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 
-from db import get_connection
+from db import analyze, get_connection, upsert_rows
+from youtube_api import execute, quota
 
 ROOT = Path(__file__).resolve().parent.parent  # tools/
 
@@ -34,6 +35,9 @@ NOEL_CHANNEL_ID = 'UCdyqAaZDKHXg4Ahi7VENThQ'
 VIDEO_TYPE_STREAM = 1
 VIDEO_TYPE_VIDEO = 2
 
+# videos().list バッチの並列数
+MAX_WORKERS = 4
+
 
 # ---------- ユーティリティ ----------
 
@@ -64,10 +68,10 @@ def iso_duration_to_hhmmss(d):
 
 def fetch_channel_info(youtube, channel_id):
     """チャンネル情報 → dict"""
-    resp = youtube.channels().list(
+    resp = execute(youtube.channels().list(
         part='snippet,brandingSettings',
         id=channel_id,
-    ).execute()
+    ))
 
     if not resp['items']:
         print(f'  警告: チャンネル {channel_id} の情報を取得できませんでした')
@@ -90,7 +94,7 @@ def fetch_channel_info(youtube, channel_id):
 
 def fetch_all_video_ids(youtube, channel_id):
     """チャンネルの全動画 ID をリストで返す。"""
-    resp = youtube.channels().list(part='contentDetails', id=channel_id).execute()
+    resp = execute(youtube.channels().list(part='contentDetails', id=channel_id))
     if not resp['items']:
         return []
 
@@ -99,12 +103,12 @@ def fetch_all_video_ids(youtube, channel_id):
     video_ids = []
     page_token = None
     while True:
-        resp = youtube.playlistItems().list(
+        resp = execute(youtube.playlistItems().list(
             part='snippet',
             playlistId=playlist_id,
             maxResults=50,
             pageToken=page_token,
-        ).execute()
+        ))
 
         for item in resp['items']:
             video_ids.append(item['snippet']['resourceId']['videoId'])
@@ -123,13 +127,17 @@ def fetch_video_details(youtube, video_ids, channel_id, premiere_ids):
     vv_types = []
     stream_details = []
 
-    for i in range(0, len(video_ids), 50):
-        batch = video_ids[i : i + 50]
-        resp = youtube.videos().list(
+    def fetch_batch(batch):
+        return execute(youtube.videos().list(
             part='snippet,contentDetails,liveStreamingDetails',
             id=','.join(batch),
-        ).execute()
+        ))
+
+    batches = [video_ids[i : i + 50] for i in range(0, len(video_ids), 50)]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        responses = list(pool.map(fetch_batch, batches))
 
+    for resp in responses:
         for v in resp['items']:
             vid = v['id']
             snippet = v['snippet']
@@ -215,44 +223,33 @@ def main():
         if info:
             new_channels.append(info)
 
-    # DB に書き込み（INSERT OR REPLACE で upsert）
+    # DB に書き込み（executemany で一括 upsert）
     conn.execute('BEGIN')
 
-    for ch in new_channels:
-        conn.execute(
-            '''INSERT INTO channels (id, title, handle, icon_url) VALUES (?, ?, ?, ?)
-               ON CONFLICT(id) DO UPDATE SET
-                 title=excluded.title, handle=excluded.handle, icon_url=excluded.icon_url''',
-            (ch['id'], ch['title'], ch['handle'], ch['icon_url']),
-        )
-
-    for v in new_videos:
-        conn.execute(
-            '''INSERT INTO videos (id, title, thumbnail_url, duration, channel_id, published_at) VALUES (?, ?, ?, ?, ?, ?)
-               ON CONFLICT(id) DO UPDATE SET
-                 title=excluded.title, thumbnail_url=excluded.thumbnail_url,
-                 duration=excluded.duration, channel_id=excluded.channel_id,
-                 published_at=excluded.published_at''',
-            (v['id'], v['title'], v['thumbnail_url'], v['duration'], v['channel_id'], v['published_at']),
-        )
-
-    for vvt in new_vv_types:
-        conn.execute(
-            '''INSERT INTO video_video_types (video_id, video_type_id) VALUES (?, ?)
-               ON CONFLICT(video_id) DO UPDATE SET
-                 video_type_id=excluded.video_type_id''',
-            (vvt['video_id'], vvt['video_type_id']),
-        )
-
-    for sd in new_stream_details:
-        conn.execute(
-            '''INSERT INTO stream_details (video_id, started_at) VALUES (?, ?)
-               ON CONFLICT(video_id) DO UPDATE SET
-                 started_at=excluded.started_at''',
-            (sd['video_id'], sd['started_at']),
-        )
+    upsert_rows(
+        conn, 'channels', ['id', 'title', 'handle', 'icon_url'],
+        ((ch['id'], ch['title'], ch['handle'], ch['icon_url']) for ch in new_channels),
+        on_conflict='update', key='id',
+    )
+    upsert_rows(
+        conn, 'videos', ['id', 'title', 'thumbnail_url', 'duration', 'channel_id', 'published_at'],
+        ((v['id'], v['title'], v['thumbnail_url'], v['duration'], v['channel_id'], v['published_at'])
+         for v in new_videos),
+        on_conflict='update', key='id',
+    )
+    upsert_rows(
+        conn, 'video_video_types', ['video_id', 'video_type_id'],
+        ((vvt['video_id'], vvt['video_type_id']) for vvt in new_vv_types),
+        on_conflict='update', key='video_id',
+    )
+    upsert_rows(
+        conn, 'stream_details', ['video_id', 'started_at'],
+        ((sd['video_id'], sd['started_at']) for sd in new_stream_details),
+        on_conflict='update', key='video_id',
+    )
 
     conn.execute('COMMIT')
+    analyze(conn)
 
     # 結果表示
     final_channels = conn.execute('SELECT COUNT(*) FROM channels').fetchone()[0]
@@ -267,6 +264,7 @@ def main():
     print(f'  videos: {final_videos}件')
     print(f'  video_video_types: {final_vvt}件')
     print(f'  stream_details: {final_sd}件')
+    print(f'  API クォータ消費: {quota.used} ユニット')
 
 
 if __name__ == '__main__':
@@ -1,6 +1,13 @@
 /**
  * prebuild スクリプト: S3 から danin-log.db を web/data/ にダウンロード
  *
+ * 先に danin-log.manifest.json を読み、その snapshot_etag を If-Match にして
+ * スナップショット（danin-log.db）を取得してから、差分（danin-log.deltas/）を順に適用する。
+ * 読み込みの間に Lambda がスナップショットを作り直した場合は 412 になるので manifest から読み直す
+ * （manifest に対応しないスナップショットと差分を組み合わせない）。
+ * 何度読み直しても一致しない場合（just deploy-data で差し替えた直後等）はスナップショットのみ使う。
+ * 差分の形式は infrastructure/lambda/changeset.py を参照。
+ *
  * Vercel ビルド時に自動実行される（npm prebuild hook）
  * ローカル開発では pnpm dev を使うため実行されない
  *
@@ -14,12 +21,18 @@
 import { writeFileSync, mkdirSync, existsSync } from 'node:fs';
 import { resolve, dirname } from 'node:path';
 import { fileURLToPath } from 'node:url';
+import { gunzipSync } from 'node:zlib';
 
-import { S3Client, GetObjectCommand } from '@aws-sdk/client-s3';
+import { S3Client, GetObjectCommand, NoSuchKey } from '@aws-sdk/client-s3';
+import Database from 'better-sqlite3';
 
 const __dirname = dirname(fileURLToPath(import.meta.url));
 const dataDir = resolve(__dirname, '..', 'data');
 const dbFile = 'danin-log.db';
+const manifestKey = 'danin-log.manifest.json';
+const deltaPrefix = 'danin-log.deltas/';
+const snapshotRetries = 3;
+const retryDelayMs = 2000;
 
 const { AWS_S3_BUCKET, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION } =
   process.env;
@@ -59,13 +72,91 @@ const destPath = resolve(dataDir, dbFile);
 
 console.log(`Downloading s3://${AWS_S3_BUCKET}/${dbFile} ...`);
 
-try {
+async function getBytes(key, ifMatch) {
   const resp = await s3.send(
-    new GetObjectCommand({ Bucket: AWS_S3_BUCKET, Key: dbFile })
+    new GetObjectCommand({
+      Bucket: AWS_S3_BUCKET,
+      Key: key,
+      IfMatch: ifMatch,
+    })
+  );
+  return { body: await resp.Body.transformToByteArray(), etag: resp.ETag };
+}
+
+async function loadManifest() {
+  try {
+    const { body } = await getBytes(manifestKey);
+    return JSON.parse(Buffer.from(body).toString('utf-8'));
+  } catch (error) {
+    // バケットの ListBucket 権限がない場合、未作成は AccessDenied になる
+    if (error instanceof NoSuchKey || error.name === 'AccessDenied') {
+      console.log(`No usable ${manifestKey}; using snapshot only.`);
+      return null;
+    }
+    throw error;
+  }
+}
+
+// manifest と、それが指すスナップショットを組で取得する
+async function loadSnapshot() {
+  for (let attempt = 1; attempt <= snapshotRetries; attempt++) {
+    const manifest = await loadManifest();
+    try {
+      const { body, etag } = await getBytes(dbFile, manifest?.snapshot_etag);
+      return { body, etag, manifest };
+    } catch (error) {
+      if (error.name !== 'PreconditionFailed') throw error;
+      console.log(
+        `Snapshot does not match ${manifestKey} (attempt ${attempt}/${snapshotRetries}).`
+      );
+      if (attempt < snapshotRetries) {
+        await new Promise((r) => setTimeout(r, retryDelayMs * attempt));
+      }
+    }
+  }
+  console.log(
+    `Snapshot was replaced outside ${manifestKey}; using snapshot only.`
   );
-  const body = await resp.Body.transformToByteArray();
+  const { body, etag } = await getBytes(dbFile);
+  return { body, etag, manifest: null };
+}
+
+function applyDelta(db, delta) {
+  db.transaction(() => {
+    for (const { table, key, columns, rows } of delta.tables) {
+      const updates = columns
+        .filter((c) => !key.includes(c))
+        .map((c) => `${c} = excluded.${c}`)
+        .join(', ');
+      const stmt = db.prepare(
+        `INSERT INTO ${table} (${columns.join(', ')}) VALUES (${columns.map(() => '?').join(', ')}) ` +
+          `ON CONFLICT(${key.join(', ')}) DO UPDATE SET ${updates}`
+      );
+      for (const row of rows) stmt.run(row);
+    }
+  })();
+}
+
+try {
+  const { body, etag, manifest } = await loadSnapshot();
   writeFileSync(destPath, body);
-  console.log(`Data fetch complete. (${(body.length / 1024).toFixed(0)} KB)`);
+  console.log(`Snapshot fetched. (${(body.length / 1024).toFixed(0)} KB)`);
+
+  if (manifest && manifest.head > 0) {
+    const db = new Database(destPath);
+    db.pragma('foreign_keys = ON');
+    let bytes = 0;
+    for (let seq = 1; seq <= manifest.head; seq++) {
+      const key = `${deltaPrefix}${etag.replaceAll('"', '')}/${String(seq).padStart(6, '0')}.json.gz`;
+      const { body: delta } = await getBytes(key);
+      bytes += delta.length;
+      applyDelta(db, JSON.parse(gunzipSync(delta).toString('utf-8')));
+    }
+    db.pragma('journal_mode = DELETE');
+    db.close();
+    console.log(`Applied ${manifest.head} deltas. (${(bytes / 1024).toFixed(0)} KB)`);
+  }
+  console.log('Data fetch complete.');
 } catch (error) {
   console.error('Failed to fetch data from S3:', error.message);
   process.exit(1);